@@ -1,191 +1,770 @@
 import os
+import atexit
+import asyncio
 import time
 import json
+import re
+import copy
+import hashlib
 import logging
+import threading
+import dataclasses
+import functools
+import datetime
+from typing import Generator
+from collections import OrderedDict
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold, Tool
 from google.ai.generativelanguage_v1beta.types import GoogleSearchRetrieval
 from google.generativeai.types import GenerationConfig as GeminiGenerationConfig
+from google.generativeai import caching
+from google.api_core import exceptions as gax
+try:
+    import orjson # Optional: faster JSON parsing/formatting for structured responses
+except ImportError:
+    orjson = None
+try:
+    import tiktoken # Optional: closer local token estimates when usage metadata is missing
+except ImportError:
+    tiktoken = None
+from config import settings
+from api.rate_control import gemini_controller, gemini_quota_limiter
+from api import usage_store, response_store
 
-# Global variables for token tracking
-total_prompt_tokens_used = 0
-total_candidates_tokens_used = 0
-total_tokens_accumulated = 0
+@dataclasses.dataclass
+class _TokenCounts:
+    """Accumulated token usage across all Gemini calls in this process."""
+    prompt: int = 0
+    candidates: int = 0
+    total: int = 0
+    cache_hit: int = 0 # Tokens that would have been billed for calls served from the response cache
+    estimated: int = 0 # Portion of `total` estimated locally rather than reported by the API
+
+# Token tracking shared by all threads; each call flushes its usage under the lock exactly once
+_TOKEN_COUNTS = _TokenCounts()
+_TOKEN_COUNTS_LOCK = threading.Lock()
+
+# Module logger ("api.gemini_client"): its warnings and errors are also shown on the console (see setup_logging),
+# and it is used to skip building debug-only strings when DEBUG logging is disabled
+_logger = logging.getLogger(__name__)
+
+# Response cache (LRU order): key -> (stored_at, content, finish_reason, total_tokens)
+_RESPONSE_CACHE: OrderedDict[str, tuple[float, str | dict | list, str, int]] = OrderedDict()
+# Second tier: key of the normalized prompt -> exact key of a response cached for an equivalent prompt
+_NEAR_DUPLICATE_INDEX: dict[str, str] = {}
+_RESPONSE_CACHE_LOCK = threading.Lock()
+_CACHE_STATS = {"exact_hits": 0, "near_duplicate_hits": 0, "misses": 0}
+_CACHEABLE_FINISH_REASONS = {"STOP", "MAX_TOKENS"}
+
+# Safety settings sent with every request (identical for all calls)
+_SAFETY_SETTINGS = {
+    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+}
+
+# Stdlib decoder used to read the first JSON value out of text that may carry fences or trailing prose
+_JSON_DECODER = json.JSONDecoder()
+
+# Static instruction appended for continuation calls. Sent once as cached content where the API allows it.
+_CONTINUATION_INSTRUCTION = (
+    "Please continue the narration seamlessly from where the previous text ended. "
+    "Ensure you maintain the exact same tone, style, and all previous instructions. "
+    "Do not repeat any content from the provided 'previous text'. "
+    "Focus solely on generating the next part of the narrative as if no interruption occurred."
+)
+
+# Inline form of the continuation instruction, appended to the previous text when cached content is unavailable
+_CONTINUATION_INSTR = f"\n\n\n{_CONTINUATION_INSTRUCTION}\n"
+
+# Provider-side cached content for continuation calls: (model name, system instruction) -> cached model or None
+_CONTINUATION_CACHED_MODELS: dict[tuple[str, str], genai.GenerativeModel | None] = {}
+_CONTINUATION_CACHED_MODELS_LOCK = threading.Lock()
+
+# Provider-side cached content for shared prompt prefixes: BLAKE2b of (model, system instruction, prefix) -> cached model or None
+_PREFIX_CACHED_MODELS: dict[str, genai.GenerativeModel | None] = {}
+_PREFIX_CACHED_MODELS_LOCK = threading.Lock()
+# Cached content name -> stable identity of its contents, so response cache keys survive re-creating the cache
+_CACHED_CONTENT_IDENTITIES: dict[str, str] = {}
+# Cached contents created by this process, deleted at exit rather than left to expire
+_CREATED_CACHED_CONTENTS: list[caching.CachedContent] = []
+
+def get_cache_stats():
+    """Returns response cache hit/miss counts and the overall hit rate."""
+    with _RESPONSE_CACHE_LOCK:
+        stats = dict(_CACHE_STATS)
+        stats["entries"] = len(_RESPONSE_CACHE)
+    lookups = stats["exact_hits"] + stats["near_duplicate_hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["exact_hits"] + stats["near_duplicate_hits"]) / lookups if lookups else 0.0
+    return stats
 
 def get_token_usage():
     """Returns the current accumulated token usage."""
-    return {
-        "prompt_tokens": total_prompt_tokens_used,
-        "candidates_tokens": total_candidates_tokens_used,
-        "total_tokens": total_tokens_accumulated
-    }
+    with _TOKEN_COUNTS_LOCK:
+        return {
+            "prompt_tokens": _TOKEN_COUNTS.prompt,
+            "candidates_tokens": _TOKEN_COUNTS.candidates,
+            "total_tokens": _TOKEN_COUNTS.total,
+            "cache_hit_tokens": _TOKEN_COUNTS.cache_hit,
+            "estimated_tokens": _TOKEN_COUNTS.estimated
+        }
+
+def _record_token_usage(prompt: int = 0, candidates: int = 0, total: int = 0, cache_hit: int = 0, estimated: int = 0) -> _TokenCounts:
+    """Adds one call's usage to the shared totals in a single lock acquisition and returns a snapshot."""
+    with _TOKEN_COUNTS_LOCK:
+        _TOKEN_COUNTS.prompt += prompt
+        _TOKEN_COUNTS.candidates += candidates
+        _TOKEN_COUNTS.total += total
+        _TOKEN_COUNTS.cache_hit += cache_hit
+        _TOKEN_COUNTS.estimated += estimated
+        return dataclasses.replace(_TOKEN_COUNTS)
+
+def clear_cache():
+    """Empties the in-process response cache."""
+    with _RESPONSE_CACHE_LOCK:
+        _RESPONSE_CACHE.clear()
+        _NEAR_DUPLICATE_INDEX.clear()
+    _logger.info("Gemini response cache cleared.")
+
+class _LocalTokenizer:
+    """Estimates token counts locally so missing usage metadata doesn't cost extra count_tokens round-trips."""
 
-def call_gemini_api(model: genai.GenerativeModel, prompt_content: str, generation_config: GeminiGenerationConfig, max_retries=3, initial_delay=5, is_continuation=False, previous_text="") -> tuple[str | dict | None, str]:
+    _encoding = None
+
+    @staticmethod
+    @functools.lru_cache(maxsize=8192)
+    def count(text: str) -> int:
+        if not text:
+            return 0
+        if tiktoken is not None:
+            if _LocalTokenizer._encoding is None:
+                _LocalTokenizer._encoding = tiktoken.get_encoding("cl100k_base")
+            return len(_LocalTokenizer._encoding.encode(text))
+        # Fall back to the same words-to-tokens ratio used for script length planning
+        return int(len(re.findall(r'\w+', text)) * settings.TOKENS_PER_WORD_ESTIMATE)
+
+def _json_loads(text: str):
+    """Parses JSON with orjson when available, falling back to the stdlib parser."""
+    if orjson is not None:
+        return orjson.loads(text.encode("utf-8"))
+    return json.loads(text)
+
+def _parse_json_payload(text: str):
     """
-    Calls the Gemini API with retry logic and token counting.
-    Returns the generated content (str or dict for JSON) and the finish reason string.
+    Parses the first JSON object/array in a model response, ignoring any surrounding markdown fences or trailing text.
+    Raises json.JSONDecodeError if no valid JSON value is found.
     """
-    global total_prompt_tokens_used, total_candidates_tokens_used, total_tokens_accumulated # Use global counters
+    start = text.find("{")
+    array_start = text.find("[")
+    if start == -1 or (array_start != -1 and array_start < start):
+        start = array_start
+    if start == -1:
+        raise json.JSONDecodeError("No JSON object or array found", text, 0)
+
+    # Fast path: the payload runs to the last matching closer, as in plain or fenced output
+    end = text.rfind("}" if text[start] == "{" else "]")
+    if end > start:
+        try:
+            return _json_loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            pass # Trailing text contains a stray closer; let the incremental decoder find the real end
 
-    full_prompt_for_continuation = prompt_content # Default for non-continuation or first attempt
+    return _JSON_DECODER.raw_decode(text, start)[0]
 
+def _json_dumps_pretty(obj) -> str:
+    """Formats JSON with two-space indentation for logging."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode("utf-8")
+    return json.dumps(obj, indent=2)
+
+def _make_cache_key(model_name: str, prompt: str, generation_config: GeminiGenerationConfig | None) -> str:
+    """
+    Builds a deterministic BLAKE2b key for a (model, prompt, generation config) triple.
+    The prompt is hashed as raw bytes rather than embedded in the JSON payload, so large prompts aren't escaped and copied first.
+    """
+    config_dict = dataclasses.asdict(generation_config) if generation_config else {}
+    key_hash = hashlib.blake2b(digest_size=16)
+    key_hash.update(json.dumps({"model": model_name, "generation_config": config_dict}, sort_keys=True, default=str).encode("utf-8"))
+    key_hash.update(b"\0")
+    key_hash.update(prompt.encode("utf-8"))
+    return key_hash.hexdigest()
+
+def _normalize_prompt(prompt: str) -> str:
+    """
+    Collapses whitespace so prompts differing only in spacing or line breaks share a near-duplicate key.
+    Case is kept: topics and research that differ only in case are different prompts.
+    """
+    return " ".join(prompt.split())
+
+def _get_cached_response(key: str, near_duplicate_key: str | None = None) -> tuple[str | dict | list, str, int] | None:
+    """
+    Returns the cached (content, finish_reason, total_tokens) for a key, or None on miss/expiry.
+    On an exact miss, falls back to a response cached for a near-duplicate prompt (same normalized key).
+    """
+    with _RESPONSE_CACHE_LOCK:
+        entry = _RESPONSE_CACHE.get(key)
+        stat_name = "exact_hits"
+        if entry is None and near_duplicate_key:
+            key = _NEAR_DUPLICATE_INDEX.get(near_duplicate_key, key)
+            entry = _RESPONSE_CACHE.get(key)
+            stat_name = "near_duplicate_hits"
+        if entry is None:
+            _CACHE_STATS["misses"] += 1
+            return None
+        stored_at, content, finish_reason, total_tokens = entry
+        if time.time() - stored_at > settings.RESPONSE_CACHE_TTL_SECONDS:
+            del _RESPONSE_CACHE[key] # Expired
+            _CACHE_STATS["misses"] += 1
+            return None
+        _RESPONSE_CACHE.move_to_end(key)
+        _CACHE_STATS[stat_name] += 1
+    if not isinstance(content, str):
+        content = copy.deepcopy(content) # Callers may mutate parsed JSON in place
+    return content, finish_reason, total_tokens
+
+def _is_reusable(generation_config: GeminiGenerationConfig | None) -> bool:
+    """
+    Responses are reused (from the in-memory cache or the persistent store) only when deterministic (temperature 0/unset)
+    unless sampled ones are opted in; otherwise two identical sampled calls would silently get the same output.
+    """
+    temperature = generation_config.temperature if generation_config else None
+    return not temperature or settings.REUSE_SAMPLED_RESPONSES
+
+def _store_cached_response(key: str, content: str | dict | list, finish_reason: str, total_tokens: int, near_duplicate_key: str | None = None, persist: bool = False):
+    """Caches a successful response, evicting the least recently used entry when full. Transient errors and blocked responses are never cached."""
+    if not settings.RESPONSE_CACHE_ENABLED or finish_reason not in _CACHEABLE_FINISH_REASONS:
+        return
+    if persist:
+        response_store.store_response(key, content, finish_reason, total_tokens)
+    with _RESPONSE_CACHE_LOCK:
+        _RESPONSE_CACHE[key] = (time.time(), content, finish_reason, total_tokens)
+        _RESPONSE_CACHE.move_to_end(key)
+        if near_duplicate_key:
+            _NEAR_DUPLICATE_INDEX[near_duplicate_key] = key
+        while len(_RESPONSE_CACHE) > settings.RESPONSE_CACHE_MAX_ENTRIES:
+            _RESPONSE_CACHE.popitem(last=False)
+        if len(_NEAR_DUPLICATE_INDEX) > settings.RESPONSE_CACHE_MAX_ENTRIES:
+            # Drop index entries whose responses have been evicted
+            for stale_key in [k for k, v in _NEAR_DUPLICATE_INDEX.items() if v not in _RESPONSE_CACHE]:
+                del _NEAR_DUPLICATE_INDEX[stale_key]
+
+def _get_retry_delay_seconds(error: Exception, fallback_delay: float) -> float:
+    """Extracts the server-suggested retry delay (RetryInfo / Retry-After) from an API error, if present."""
+    retry_delay = getattr(error, 'retry_delay', None)
+    if retry_delay is None:
+        for detail in getattr(error, 'details', None) or []:
+            retry_delay = getattr(detail, 'retry_delay', None)
+            if retry_delay is not None:
+                break
+    if retry_delay is not None:
+        seconds = getattr(retry_delay, 'seconds', retry_delay)
+        try:
+            if float(seconds) > 0:
+                return float(seconds)
+        except (TypeError, ValueError):
+            pass
+    return fallback_delay
+
+def _system_instruction_text(model: genai.GenerativeModel) -> str:
+    """Returns the model's system instruction as plain text ("" if it has none)."""
+    if getattr(model, "_system_instruction", None):
+        return "".join(part.text for part in model._system_instruction.parts)
+    return ""
+
+def _tools_text(model: genai.GenerativeModel) -> str:
+    """Returns a stable text form of the model's tools and tool config ("" if it has neither)."""
+    tools = getattr(model, "_tools", None)
+    tool_config = getattr(model, "_tool_config", None)
+    if not tools and not tool_config:
+        return ""
+    tool_dicts = [type(tool).to_dict(tool) for tool in tools.to_proto()] if tools else []
+    tool_config_dict = type(tool_config).to_dict(tool_config) if tool_config else None
+    return json.dumps({"tools": tool_dicts, "tool_config": tool_config_dict}, sort_keys=True, default=str)
+
+def _model_cache_identity(model: genai.GenerativeModel) -> str:
+    """
+    Identifies a model for response cache keys: its name, a digest of its system instruction and tools
+    (models sharing a name can differ in both), and any cached content it is bound to.
+    """
+    setup_hash = hashlib.blake2b(digest_size=8)
+    setup_hash.update(_system_instruction_text(model).encode("utf-8"))
+    setup_hash.update(b"\0")
+    setup_hash.update(_tools_text(model).encode("utf-8"))
+    identity = f"{model.model_name}:{setup_hash.hexdigest()}"
+    cached_content_name = getattr(model, "cached_content", None)
+    if not cached_content_name:
+        return identity
+    return f"{identity}:{_CACHED_CONTENT_IDENTITIES.get(cached_content_name, cached_content_name)}"
+
+def _get_continuation_model(model: genai.GenerativeModel) -> genai.GenerativeModel | None:
+    """
+    Returns a model bound to server-side cached content holding the model's system instruction
+    plus the continuation instruction, creating the cache on first use.
+    Returns None if caching is unavailable (e.g. content below the API's minimum cacheable size),
+    in which case callers should send the instruction inline.
+    """
+    system_instruction_text = _system_instruction_text(model)
+    cache_lookup_key = (model.model_name, system_instruction_text)
+
+    if cache_lookup_key in _CONTINUATION_CACHED_MODELS: # Already created (or failed); no need to take the lock
+        return _CONTINUATION_CACHED_MODELS[cache_lookup_key]
+
+    # Held while creating so concurrent sections wait for one cached content instead of each creating their own;
+    # the key is checked again because another thread may have created it while this one waited
+    with _CONTINUATION_CACHED_MODELS_LOCK:
+        if cache_lookup_key not in _CONTINUATION_CACHED_MODELS:
+            try:
+                cached_content = caching.CachedContent.create(
+                    model=model.model_name,
+                    display_name="continuation_instruction",
+                    system_instruction=f"{system_instruction_text}\n\n{_CONTINUATION_INSTRUCTION}".strip(),
+                    ttl=datetime.timedelta(minutes=settings.CONTINUATION_CACHE_TTL_MINUTES)
+                )
+                _CONTINUATION_CACHED_MODELS[cache_lookup_key] = genai.GenerativeModel.from_cached_content(cached_content)
+                _CREATED_CACHED_CONTENTS.append(cached_content)
+                _logger.info(f"Created cached content {cached_content.name} for continuation calls on {model.model_name}.")
+            except Exception as e:
+                # Remember the failure so we don't retry cache creation on every continuation hop
+                _CONTINUATION_CACHED_MODELS[cache_lookup_key] = None
+                _logger.warning(f"Could not create cached content for continuation calls on {model.model_name}; sending instruction inline. Reason: {e}")
+        return _CONTINUATION_CACHED_MODELS[cache_lookup_key]
+
+def get_prefix_cached_model(model: genai.GenerativeModel, prefix_text: str) -> genai.GenerativeModel | None:
+    """
+    Returns a model bound to server-side cached content holding the model's system instruction plus `prefix_text`
+    (e.g. the topic and research material every section prompt starts with), creating the cache on first use.
+    Prompts sent to the returned model should omit the prefix.
+    Returns None if the prefix is too short to cache or cache creation fails; callers then send the prefix inline.
+    """
+    if len(prefix_text) < settings.RESEARCH_CONTEXT_CACHE_MIN_CHARS:
+        return None
+    system_instruction_text = _system_instruction_text(model)
+    key_hash = hashlib.blake2b(digest_size=16)
+    for part in (model.model_name, system_instruction_text, prefix_text):
+        key_hash.update(part.encode("utf-8"))
+        key_hash.update(b"\0")
+    cache_lookup_key = key_hash.hexdigest()
+
+    # Held while creating so concurrent sections wait for one upload instead of each creating their own
+    with _PREFIX_CACHED_MODELS_LOCK:
+        if cache_lookup_key not in _PREFIX_CACHED_MODELS:
+            try:
+                cached_content = caching.CachedContent.create(
+                    model=model.model_name,
+                    display_name="shared_prompt_prefix",
+                    system_instruction=system_instruction_text or None,
+                    contents=[prefix_text],
+                    ttl=datetime.timedelta(minutes=settings.RESEARCH_CONTEXT_CACHE_TTL_MINUTES)
+                )
+                _PREFIX_CACHED_MODELS[cache_lookup_key] = genai.GenerativeModel.from_cached_content(cached_content)
+                _CACHED_CONTENT_IDENTITIES[cached_content.name] = cache_lookup_key
+                _CREATED_CACHED_CONTENTS.append(cached_content)
+                _logger.info(f"Created cached content {cached_content.name} for a {len(prefix_text)}-char shared prompt prefix on {model.model_name}.")
+            except Exception as e:
+                # Remember the failure so every section doesn't retry cache creation
+                _PREFIX_CACHED_MODELS[cache_lookup_key] = None
+                _logger.warning(f"Could not create cached content for the shared prompt prefix on {model.model_name}; sending it inline. Reason: {e}")
+        return _PREFIX_CACHED_MODELS[cache_lookup_key]
+
+def bind_prefix_cached_model(model: genai.GenerativeModel, prefix_text: str) -> tuple[genai.GenerativeModel, str]:
+    """
+    Returns (model, prompt prefix to send). With research context caching, the model is bound to cached content
+    holding `prefix_text` and the prefix to send is empty; otherwise the model and the inline prefix are returned.
+    """
+    if settings.USE_RESEARCH_CONTEXT_CACHE:
+        cached_model = get_prefix_cached_model(model, prefix_text)
+        if cached_model is not None:
+            return cached_model, ""
+    return model, prefix_text
+
+@atexit.register
+def _delete_created_cached_contents():
+    """Deletes the cached contents this process created instead of paying for storage until their TTL expires."""
+    while _CREATED_CACHED_CONTENTS:
+        cached_content = _CREATED_CACHED_CONTENTS.pop()
+        try:
+            cached_content.delete()
+        except Exception as e:
+            _logger.warning(f"Could not delete cached content {cached_content.name}: {e}")
+
+def configure(api_key: str):
+    """
+    Configures the Gemini SDK once per process. All models then share the SDK's default
+    generative client, so the underlying gRPC channel is reused rather than re-established per model.
+    """
+    genai.configure(api_key=api_key, transport=settings.GEMINI_TRANSPORT)
+    get_model.cache_clear() # Models built under a previous configuration must not be reused
+    _logger.info(f"Gemini SDK configured (transport={settings.GEMINI_TRANSPORT}).")
+
+@functools.lru_cache(maxsize=8)
+def get_model(model_name: str, system_instruction: str | None = None, use_search_tool: bool = False) -> genai.GenerativeModel:
+    """
+    Returns a shared GenerativeModel for the given name/system instruction/tool combination.
+    Callers should obtain models here (after configure()) instead of constructing them repeatedly.
+    """
+    tools = None
+    if use_search_tool:
+        tools = [Tool(google_search_retrieval=GoogleSearchRetrieval())]
+    _logger.info(f"Creating Gemini model {model_name} (system instruction: {'yes' if system_instruction else 'no'}, search tool: {use_search_tool}).")
+    return genai.GenerativeModel(model_name=model_name, system_instruction=system_instruction, tools=tools)
+
+def _candidate_text(candidate) -> str:
+    """Joins the text parts of one response candidate ("" if it has none)."""
+    content = getattr(candidate, 'content', None)
+    return "".join(getattr(part, 'text', "") for part in (content.parts if content else []))
+
+def call_gemini_api(model: genai.GenerativeModel, prompt_content: str, generation_config: GeminiGenerationConfig, max_retries=3, initial_delay=5, is_continuation=False, previous_text="") -> tuple[str | dict | list | None, str]:
+    """
+    Calls the Gemini API with retry logic and token counting.
+    Returns the generated content (str or dict for JSON) and the finish reason string.
+    Text calls whose config sets candidate_count > 1 return a list of the candidate texts instead
+    (finish reason of the first candidate).
+    """
     if is_continuation and previous_text:
-        full_prompt_for_continuation = (
-            f"{previous_text}\n\n"
-            f"\n"
-            f"Please continue the narration seamlessly from where the previous text ended. "
-            f"Ensure you maintain the exact same tone, style, and all previous instructions. "
-            f"Do not repeat any content from the provided 'previous text'. "
-            f"Focus solely on generating the next part of the narrative as if no interruption occurred.\n"
-            f""
-        )
+        continuation_model = _get_continuation_model(model) if settings.USE_CONTINUATION_CONTEXT_CACHE else None
+        if continuation_model:
+            # Instruction lives in the cached content; only the previous text travels with the request
+            model = continuation_model
+            final_prompt_to_send = previous_text
+        else:
+            final_prompt_to_send = previous_text + _CONTINUATION_INSTR
         # Log only the instruction part for continuation for brevity
-        logging.info(f"Calling Gemini API (Continuation) using model {model.model_name}. Max tokens: {generation_config.max_output_tokens if generation_config else 'default'}. Prompt (instruction part): ...")
+        _logger.info(f"Calling Gemini API (Continuation) using model {model.model_name}. Max tokens: {generation_config.max_output_tokens if generation_config else 'default'}. Prompt (instruction part): ...")
     else:
-        logging.info(f"Calling Gemini API using model {model.model_name}. Max tokens: {generation_config.max_output_tokens if generation_config else 'default'}. Prompt (first 100 chars): {str(prompt_content)[:100]}")
+        final_prompt_to_send = prompt_content
+        _logger.info(f"Calling Gemini API using model {model.model_name}. Max tokens: {generation_config.max_output_tokens if generation_config else 'default'}. Prompt (first 100 chars): {str(prompt_content)[:100]}")
+
+    # --- Response Cache Lookup ---
+    cache_key = None
+    near_duplicate_key = None
+    persist_response = False
+    if settings.RESPONSE_CACHE_ENABLED and _is_reusable(generation_config):
+        cache_key = _make_cache_key(_model_cache_identity(model), final_prompt_to_send, generation_config)
+        if settings.NEAR_DUPLICATE_CACHE_ENABLED:
+            near_duplicate_key = _make_cache_key(_model_cache_identity(model), _normalize_prompt(final_prompt_to_send), generation_config)
+        persist_response = settings.PERSIST_RESPONSE_CACHE
+        cached = _get_cached_response(cache_key, near_duplicate_key)
+        if cached is None and persist_response:
+            cached = response_store.get_response(cache_key) # Response from a previous run
+        if cached is not None:
+            cached_content, cached_finish_reason, cached_tokens = cached
+            _record_token_usage(cache_hit=cached_tokens)
+            _logger.info(f"Gemini response cache hit (key {cache_key[:12]}). Skipped API call saving ~{cached_tokens} tokens. Finish Reason: {cached_finish_reason}")
+            return cached_content, cached_finish_reason
+
+    if not gemini_controller.allow_request():
+        _logger.error("Gemini API circuit breaker is open. Skipping call.")
+        return None, "CIRCUIT_OPEN"
+
+    wants_json = bool(generation_config and generation_config.response_mime_type == "application/json")
 
     current_retries = 0
     while current_retries < max_retries:
         try:
-            safety_settings = {
-                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-            }
-
-            # Use full_prompt_for_continuation which includes previous_text if it's a continuation call
-            final_prompt_to_send = full_prompt_for_continuation if is_continuation else prompt_content
-
-            response = model.generate_content(
-                final_prompt_to_send,
-                generation_config=generation_config,
-                safety_settings=safety_settings
-            )
+            # Wait for RPM/TPM headroom before sending (cheap ~4 chars/token estimate, refined below)
+            quota_entry = gemini_quota_limiter.wait_if_throttled(model.model_name, len(final_prompt_to_send) // 4)
+
+            # Respect the adaptive concurrency limit shared by all callers
+            gemini_controller.acquire()
+            call_start_time = time.monotonic()
+            try:
+                response = model.generate_content(
+                    final_prompt_to_send,
+                    generation_config=generation_config,
+                    safety_settings=_SAFETY_SETTINGS
+                )
+            finally:
+                gemini_controller.release()
+            gemini_controller.on_success(time.monotonic() - call_start_time)
 
             # --- Token Counting ---
             prompt_tokens_this_call = 0
             candidates_tokens_this_call = 0
             total_tokens_this_call_reported = 0
+            estimated_tokens_this_call = 0
 
             if hasattr(response, 'usage_metadata') and response.usage_metadata:
                 usage = response.usage_metadata
                 prompt_tokens_this_call = usage.prompt_token_count
-                candidates_tokens_this_call = usage.candidates_token_count if hasattr(usage, 'candidates_token_count') else 0
-                total_tokens_this_call_reported = usage.total_token_count if hasattr(usage, 'total_token_count') else (prompt_tokens_this_call + candidates_tokens_this_call)
-            else: # Manual counting if metadata is missing
+                cached_tokens_this_call = getattr(usage, 'cached_content_token_count', 0) or 0
+                if cached_tokens_this_call:
+                    # Cached prefix tokens are billed at the reduced cached rate; keep them out of the prompt total
+                    prompt_tokens_this_call = max(0, prompt_tokens_this_call - cached_tokens_this_call)
+                    _logger.info(f"Prompt included {cached_tokens_this_call} tokens served from cached content.")
+                candidates_tokens_this_call = getattr(usage, 'candidates_token_count', 0)
+                total_tokens_this_call_reported = getattr(usage, 'total_token_count', prompt_tokens_this_call + candidates_tokens_this_call)
+            else: # Local estimate if metadata is missing (avoids two extra count_tokens API round-trips)
                 try:
-                    prompt_tokens_this_call = model.count_tokens(final_prompt_to_send).total_tokens
+                    prompt_tokens_this_call = _LocalTokenizer.count(final_prompt_to_send)
                     if hasattr(response, 'text') and response.text: # Check if response has text before counting
-                         candidates_tokens_this_call = model.count_tokens(response.text).total_tokens
-                    # Note: manual counting might not exactly match API's internal total for complex cases
+                         candidates_tokens_this_call = _LocalTokenizer.count(response.text)
+                    # Note: local estimates will not exactly match the API's internal count
                     total_tokens_this_call_reported = prompt_tokens_this_call + candidates_tokens_this_call
-                    logging.warning(f"Token usage metadata not found. Manually counted: Prompt={prompt_tokens_this_call}, Candidates={candidates_tokens_this_call}")
+                    estimated_tokens_this_call = total_tokens_this_call_reported
+                    _logger.warning(f"Token usage metadata not found. Estimated locally: Prompt={prompt_tokens_this_call}, Candidates={candidates_tokens_this_call}")
                 except Exception as e_count:
-                    logging.error(f"Could not count tokens manually after missing metadata: {e_count}")
+                    _logger.error(f"Could not estimate tokens locally after missing metadata: {e_count}")
                     # Set to 0 to avoid inflating totals if counting fails
                     prompt_tokens_this_call = 0
                     candidates_tokens_this_call = 0
                     total_tokens_this_call_reported = 0
+                    estimated_tokens_this_call = 0
 
 
-            total_prompt_tokens_used += prompt_tokens_this_call
-            total_candidates_tokens_used += candidates_tokens_this_call
-            total_tokens_accumulated += total_tokens_this_call_reported
+            if total_tokens_this_call_reported:
+                gemini_quota_limiter.record_actual_tokens(quota_entry, total_tokens_this_call_reported)
 
-            logging.info(f"Token usage for this call: Prompt={prompt_tokens_this_call}, Candidates={candidates_tokens_this_call}, Total Reported={total_tokens_this_call_reported}")
-            logging.info(f"Accumulated tokens: Prompt={total_prompt_tokens_used}, Candidates={total_candidates_tokens_used}, Total={total_tokens_accumulated}")
+            accumulated = _record_token_usage(
+                prompt=prompt_tokens_this_call,
+                candidates=candidates_tokens_this_call,
+                total=total_tokens_this_call_reported,
+                estimated=estimated_tokens_this_call
+            )
+            usage_store.record_call(model.model_name, prompt_tokens_this_call, candidates_tokens_this_call, total_tokens_this_call_reported)
+
+            _logger.info(f"Token usage for this call: Prompt={prompt_tokens_this_call}, Candidates={candidates_tokens_this_call}, Total Reported={total_tokens_this_call_reported}")
+            _logger.info(f"Accumulated tokens: Prompt={accumulated.prompt}, Candidates={accumulated.candidates}, Total={accumulated.total}")
             # --- End Token Counting ---
 
             if not response.candidates:
-                logging.warning(f"Gemini response has no candidates. Prompt feedback: {response.prompt_feedback}")
                 block_reason_msg = ""
                 if response.prompt_feedback and response.prompt_feedback.block_reason:
                     block_reason_msg = f" Reason: {response.prompt_feedback.block_reason.name}."
                     if response.prompt_feedback.block_reason_message:
                          block_reason_msg += f" Message: {response.prompt_feedback.block_reason_message}"
-                print(f"WARNING: Gemini response was blocked or empty.{block_reason_msg}")
+                _logger.warning(f"Gemini response was blocked or empty (no candidates).{block_reason_msg} Prompt feedback: {response.prompt_feedback}")
                 return None, "BLOCKED_OR_EMPTY"
 
-            # Updated finish_reason handling for new API structure
-            finish_reason = "UNKNOWN"
-            if hasattr(response, 'candidates') and response.candidates:
-                # Try to get finish_reason from the first candidate
-                if len(response.candidates) > 0:
-                    candidate = response.candidates[0]
-                    if hasattr(candidate, 'finish_reason'):
-                        finish_reason = candidate.finish_reason.name if candidate.finish_reason else "UNKNOWN"
-                    elif hasattr(candidate, 'finishReason'):  # Alternative attribute name
-                        finish_reason = candidate.finishReason.name if candidate.finishReason else "UNKNOWN"
+            # Finish reason of the first candidate (candidates are known to be non-empty here)
+            try:
+                finish_reason = response.candidates[0].finish_reason.name
+            except (AttributeError, IndexError):
+                finish_reason = "UNKNOWN"
 
             # Handle JSON response type specifically
-            if generation_config and generation_config.response_mime_type == "application/json":
+            if wants_json:
                 try:
                     if isinstance(response.text, str):
-                        cleaned_text = response.text.strip()
-                        if cleaned_text.startswith("```json"): cleaned_text = cleaned_text[7:]
-                        if cleaned_text.endswith("```"): cleaned_text = cleaned_text[:-3]
-                        cleaned_text = cleaned_text.strip()
-                        json_response = json.loads(cleaned_text)
-                        # Log the JSON response
-                        logging.debug(f"Gemini API JSON response: {json.dumps(json_response, indent=2)}")
+                        # Locate the JSON payload directly; fences and trailing text are skipped rather than stripped
+                        json_response = _parse_json_payload(response.text) # orjson.JSONDecodeError subclasses json.JSONDecodeError
+                        # Log the JSON response (formatting skipped entirely when DEBUG is off)
+                        if _logger.isEnabledFor(logging.DEBUG):
+                            _logger.debug("Gemini API JSON response: %s", _json_dumps_pretty(json_response))
                     else:
                         # If not string, maybe it's already the expected type (less likely for API text response)
                         json_response = response.text
                         # Log the non-string JSON response
-                        logging.debug(f"Gemini API non-string JSON response: {str(json_response)}")
+                        _logger.debug("Gemini API non-string JSON response: %s", json_response)
 
-                    logging.info("Gemini API call successful (JSON response).")
+                    _logger.info("Gemini API call successful (JSON response).")
+                    if cache_key: _store_cached_response(cache_key, json_response, finish_reason, total_tokens_this_call_reported, near_duplicate_key, persist_response)
                     return json_response, finish_reason
 
                 except json.JSONDecodeError as e:
-                    logging.error(f"Failed to parse JSON response: {e}. Response text: {response.text[:500]}...", exc_info=True)
-                    print(f"ERROR: Failed to parse JSON response from AI for section proposal.")
+                    _logger.error("Failed to parse JSON response: %s. Response text: %.500s...", e, response.text, exc_info=True)
                     return None, "JSON_DECODE_ERROR"
                 except AttributeError:
-                    logging.error(f"Unexpected response structure for JSON. response.candidates.content: {getattr(response.candidates, 'content', 'N/A')}", exc_info=True)
+                    _logger.error(f"Unexpected response structure for JSON. response.candidates.content: {getattr(response.candidates, 'content', 'N/A')}", exc_info=True)
                     return None, "ATTRIBUTE_ERROR_JSON"
 
+            # Several candidates requested (candidate_count > 1): return the non-empty candidate texts as a list
+            if generation_config and (generation_config.candidate_count or 1) > 1:
+                candidate_texts = [text for text in map(_candidate_text, response.candidates) if text.strip()]
+                if not candidate_texts:
+                    _logger.warning(f"Gemini API returned {len(response.candidates)} candidates, all empty. Finish Reason: {finish_reason}")
+                    return None, finish_reason
+                _logger.info(f"Gemini API call successful ({len(candidate_texts)} text candidates). Finish Reason: {finish_reason}")
+                if cache_key: _store_cached_response(cache_key, candidate_texts, finish_reason, total_tokens_this_call_reported, near_duplicate_key, persist_response)
+                return candidate_texts, finish_reason
+
             # Handle Text response
             generated_text = response.text
 
             # Log the text response (truncated if too long)
-            if generated_text:
+            if generated_text and _logger.isEnabledFor(logging.DEBUG):
                 # Truncate long responses in logs to avoid overwhelming the log file
                 log_text = generated_text[:1000] + "..." if len(generated_text) > 1000 else generated_text
-                logging.debug(f"Gemini API text response: {log_text}")
+                _logger.debug("Gemini API text response: %s", log_text)
 
             # Check for empty response text unless finish reason explains it
             if not generated_text.strip() and finish_reason not in ["STOP", "MAX_TOKENS", "SAFETY"]: # Allow empty if max_tokens, stop, or safety
-                logging.warning(f"Gemini API returned an empty text response despite having candidates. Finish Reason: {finish_reason}")
-                print(f"WARNING: Gemini API returned an empty text response. Finish Reason: {finish_reason}")
+                _logger.warning(f"Gemini API returned an empty text response despite having candidates. Finish Reason: {finish_reason}")
                 # If it's truly empty for unexpected reasons, return None
                 return None, finish_reason
 
-            logging.info(f"Gemini API call successful (Text response). Finish Reason: {finish_reason}")
+            _logger.info(f"Gemini API call successful (Text response). Finish Reason: {finish_reason}")
+            if cache_key: _store_cached_response(cache_key, generated_text, finish_reason, total_tokens_this_call_reported, near_duplicate_key, persist_response)
             return generated_text, finish_reason # Return text and finish reason
 
         except (genai.types.generation_types.BlockedPromptException, genai.types.generation_types.StopCandidateException) as specific_gen_error:
-             logging.error(f"Gemini generation error: {specific_gen_error}", exc_info=True)
-             print(f"ERROR: Gemini generation process failed: {specific_gen_error}")
+             _logger.error(f"Gemini generation error: {specific_gen_error}", exc_info=True)
              return None, "GENERATION_ERROR"
+        except gax.NotFound as e:
+            _logger.error(f"Gemini API error (model or endpoint not found): {e}", exc_info=True)
+            return None, "API_NOT_FOUND"
+        except gax.ResourceExhausted as e:
+            _logger.error(f"Gemini API rate limit/quota error (Attempt {current_retries + 1}/{max_retries}): {e}", exc_info=True)
+            if "doesn't have a free quota tier" in str(e): # Not transient; retrying won't help
+                return None, "RATE_LIMIT_OR_QUOTA"
+            gemini_controller.on_error("RATE_LIMIT")
+            current_retries += 1
+            if current_retries >= max_retries:
+                return None, "RATE_LIMIT_OR_QUOTA"
+            # Honor the server's suggested retry delay before trying again
+            delay = _get_retry_delay_seconds(e, initial_delay * (2 ** current_retries))
+            _logger.warning(f"Rate limited by Gemini API. Retrying in {delay:.1f}s.")
+            time.sleep(delay)
+        except (gax.InternalServerError, gax.ServiceUnavailable, gax.DeadlineExceeded) as e:
+            _logger.error(f"Gemini API server error (Attempt {current_retries + 1}/{max_retries}): {e}", exc_info=True)
+            gemini_controller.on_error("SERVER_ERROR")
+            delay = initial_delay * (2 ** current_retries)
+            time.sleep(delay)
+            current_retries += 1
         except Exception as e:
-            logging.error(f"Gemini API error (Attempt {current_retries + 1}/{max_retries}): {e}", exc_info=True)
-            print(f"ERROR: Gemini API call failed (Attempt {current_retries + 1}/{max_retries}): {e}")
-
-            # Handle specific API errors
-            if "404" in str(e) and "is not found for API version v1beta" in str(e):
-                 return None, "API_NOT_FOUND"
-            elif "429" in str(e) or "ResourceExhausted" in str(e) or "doesn't have a free quota tier" in str(e):
-                 return None, "RATE_LIMIT_OR_QUOTA"
-            elif "500" in str(e) or "503" in str(e):
-                delay = initial_delay * (2 ** current_retries)
-                time.sleep(delay)
-                current_retries += 1
-            else:
-                return None, "UNKNOWN_API_ERROR"
+            _logger.error(f"Gemini API error (Attempt {current_retries + 1}/{max_retries}): {e}", exc_info=True)
+            return None, "UNKNOWN_API_ERROR"
 
     # If max retries are reached
-    logging.error("Max retries reached for Gemini API call.")
-    print("ERROR: Max retries reached.")
-    return None, "MAX_RETRIES_REACHED"
\ No newline at end of file
+    _logger.error("Max retries reached for Gemini API call.")
+    return None, "MAX_RETRIES_REACHED"
+
+def call_gemini_api_streaming(model: genai.GenerativeModel, prompt_content: str, generation_config: GeminiGenerationConfig) -> Generator[str, None, str]:
+    """
+    Streams generated text from the Gemini API, yielding chunks as they arrive so callers can
+    start processing (writing, measuring length) before the full response is produced.
+    The generator's return value (StopIteration.value, or the result of `yield from`) is the finish reason.
+    Callers needing the full text should accumulate the chunks and "".join() them.
+    Streaming calls are not retried or cached: once chunks are yielded a retry would duplicate output.
+    If the caller closes the generator early, usage is estimated locally from the text received so far.
+    """
+    _logger.info(f"Calling Gemini API (Streaming) using model {model.model_name}. Max tokens: {generation_config.max_output_tokens if generation_config else 'default'}. Prompt (first 100 chars): {str(prompt_content)[:100]}")
+
+    if not gemini_controller.allow_request():
+        _logger.error("Gemini API circuit breaker is open. Skipping streaming call.")
+        return "CIRCUIT_OPEN"
+
+    quota_entry = gemini_quota_limiter.wait_if_throttled(model.model_name, len(prompt_content) // 4)
+    streamed_parts: list[str] = []
+    response_iter = None
+    finish_reason = "UNKNOWN"
+
+    gemini_controller.acquire()
+    call_start_time = time.monotonic()
+    try:
+        response_iter = model.generate_content(
+            prompt_content,
+            generation_config=generation_config,
+            safety_settings=_SAFETY_SETTINGS,
+            stream=True
+        )
+        for chunk in response_iter:
+            try:
+                chunk_text = chunk.text
+            except ValueError: # Chunk without text parts (e.g. final metadata-only chunk)
+                chunk_text = ""
+            if chunk_text:
+                streamed_parts.append(chunk_text)
+                yield chunk_text
+    except GeneratorExit:
+        # Caller stopped consuming early; account for what was received and stop
+        received_text = "".join(streamed_parts)
+        estimated_prompt = _LocalTokenizer.count(prompt_content)
+        estimated_candidates = _LocalTokenizer.count(received_text)
+        estimated_total = estimated_prompt + estimated_candidates
+        _record_token_usage(prompt=estimated_prompt, candidates=estimated_candidates, total=estimated_total, estimated=estimated_total)
+        usage_store.record_call(model.model_name, estimated_prompt, estimated_candidates, estimated_total)
+        gemini_quota_limiter.record_actual_tokens(quota_entry, estimated_total)
+        _logger.info(f"Streaming call closed early by caller after {len(received_text)} chars.")
+        raise
+    except (genai.types.generation_types.BlockedPromptException, genai.types.generation_types.StopCandidateException) as specific_gen_error:
+        _logger.error(f"Gemini streaming generation error: {specific_gen_error}", exc_info=True)
+        return "GENERATION_ERROR"
+    except Exception as e:
+        _logger.error(f"Gemini streaming API error: {e}", exc_info=True)
+        gemini_controller.on_error("STREAM_ERROR")
+        return "STREAM_ERROR"
+    finally:
+        gemini_controller.release()
+
+    gemini_controller.on_success(time.monotonic() - call_start_time)
+
+    usage = getattr(response_iter, 'usage_metadata', None)
+    if usage:
+        prompt_tokens = usage.prompt_token_count
+        candidates_tokens = getattr(usage, 'candidates_token_count', 0)
+        total_tokens = getattr(usage, 'total_token_count', prompt_tokens + candidates_tokens)
+        accumulated = _record_token_usage(prompt=prompt_tokens, candidates=candidates_tokens, total=total_tokens)
+    else:
+        prompt_tokens = _LocalTokenizer.count(prompt_content)
+        candidates_tokens = _LocalTokenizer.count("".join(streamed_parts))
+        total_tokens = prompt_tokens + candidates_tokens
+        accumulated = _record_token_usage(prompt=prompt_tokens, candidates=candidates_tokens, total=total_tokens, estimated=total_tokens)
+    gemini_quota_limiter.record_actual_tokens(quota_entry, total_tokens)
+    usage_store.record_call(model.model_name, prompt_tokens, candidates_tokens, total_tokens)
+
+    try:
+        finish_reason = response_iter.candidates[0].finish_reason.name
+    except (AttributeError, IndexError):
+        finish_reason = "UNKNOWN"
+
+    _logger.info(f"Token usage for streaming call: Prompt={prompt_tokens}, Candidates={candidates_tokens}, Total={total_tokens}")
+    _logger.info(f"Accumulated tokens: Prompt={accumulated.prompt}, Candidates={accumulated.candidates}, Total={accumulated.total}")
+    _logger.info(f"Gemini API streaming call complete ({len(streamed_parts)} chunks). Finish Reason: {finish_reason}")
+    return finish_reason
+
+def call_gemini_api_with_word_limit(model: genai.GenerativeModel, prompt_content: str, generation_config: GeminiGenerationConfig, word_limit: int) -> tuple[str | None, str]:
+    """
+    Streams a text response and stops reading as soon as `word_limit` words have arrived,
+    returning the text received so far with the finish reason "EARLY_STOP".
+    Responses that end before the limit are returned whole with the model's finish reason.
+    If the stream fails before producing any text, falls back to the retried call_gemini_api.
+    """
+    stream = call_gemini_api_streaming(model, prompt_content, generation_config)
+    streamed_parts: list[str] = []
+    word_count = 0
+    try:
+        while True:
+            chunk_text = next(stream)
+            streamed_parts.append(chunk_text)
+            word_count += len(chunk_text.split())
+            if word_count >= word_limit:
+                stream.close()
+                _logger.info(f"Stopped streaming after {word_count} words (limit {word_limit}).")
+                return "".join(streamed_parts), "EARLY_STOP"
+    except StopIteration as stop:
+        finish_reason = stop.value
+
+    if not streamed_parts and finish_reason == "STREAM_ERROR":
+        _logger.warning("Streaming call failed before producing text; retrying without streaming.")
+        return call_gemini_api(model, prompt_content, generation_config)
+    return ("".join(streamed_parts) or None), finish_reason
+
+async def call_gemini_api_async(model: genai.GenerativeModel, prompt_content: str, generation_config: GeminiGenerationConfig, **kwargs) -> tuple[str | dict | None, str]:
+    """
+    Awaitable variant of call_gemini_api for running many prompts concurrently.
+    The blocking call runs in a worker thread so it shares the response cache, quota limiter,
+    adaptive concurrency controller and token counters with synchronous callers.
+    """
+    return await asyncio.to_thread(call_gemini_api, model, prompt_content, generation_config, **kwargs)
+
+async def _gather_gemini_calls(calls: list[tuple], concurrency: int) -> list[tuple[str | dict | None, str]]:
+    """Runs (model, prompt, generation_config) calls concurrently, at most `concurrency` at a time."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _bounded_call(model, prompt_content, generation_config):
+        async with semaphore:
+            return await call_gemini_api_async(model, prompt_content, generation_config)
+
+    return await asyncio.gather(*(_bounded_call(*call) for call in calls))
+
+def call_gemini_api_batch(calls: list[tuple], concurrency: int | None = None) -> list[tuple[str | dict | None, str]]:
+    """
+    Runs a batch of (model, prompt_content, generation_config) calls concurrently.
+    Returns the (content, finish_reason) results in the same order as `calls`.
+    """
+    if not calls:
+        return []
+    concurrency = concurrency or settings.MAX_CONCURRENT_GEMINI_CALLS
+    _logger.info(f"Dispatching {len(calls)} Gemini calls with concurrency {concurrency}.")
+    return asyncio.run(_gather_gemini_calls(calls, concurrency))
@@ -0,0 +1,159 @@
+import time
+import logging
+import threading
+from collections import deque
+from config import settings
+
+class AIMDController:
+    """
+    Adaptive concurrency limit for Gemini calls (additive increase, multiplicative decrease)
+    with a simple circuit breaker.
+
+    The limit grows by `alpha` while the rolling mean latency stays under `target_latency`
+    and is multiplied by `beta` on errors or when latency rises above target.
+    After `failure_threshold` consecutive errors the circuit opens and calls are rejected
+    until `cooldown_seconds` have passed; the next call then probes the API (half-open).
+    """
+
+    def __init__(self, initial_limit: float, min_limit: float, max_limit: float,
+                 alpha: float, beta: float, target_latency: float, window: int,
+                 failure_threshold: int, cooldown_seconds: float):
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.alpha = alpha
+        self.beta = beta
+        self.target_latency = target_latency
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._in_flight = 0
+        self._consecutive_failures = 0
+        self._circuit_opened_at: float | None = None
+        self._condition = threading.Condition()
+
+    def allow_request(self) -> bool:
+        """Returns False while the circuit is open."""
+        with self._condition:
+            if self._circuit_opened_at is None:
+                return True
+            if time.monotonic() - self._circuit_opened_at >= self.cooldown_seconds:
+                logging.info("Circuit breaker half-open: probing Gemini API.")
+                self._circuit_opened_at = None
+                return True
+            return False
+
+    def acquire(self):
+        """Blocks until a concurrency slot is available under the current limit."""
+        with self._condition:
+            while self._in_flight >= max(1, int(self.limit)):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self):
+        """Frees a concurrency slot."""
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency: float):
+        """Records a successful call and adjusts the limit based on the rolling mean latency."""
+        with self._condition:
+            self._consecutive_failures = 0
+            self._latencies.append(latency)
+            mean_latency = sum(self._latencies) / len(self._latencies)
+            if mean_latency <= self.target_latency:
+                self.limit = min(self.max_limit, self.limit + self.alpha)
+            else:
+                self.limit = max(self.min_limit, self.limit * self.beta)
+            logging.debug(f"AIMD: latency {latency:.2f}s, mean {mean_latency:.2f}s, concurrency limit now {self.limit:.2f}")
+            self._condition.notify_all()
+
+    def on_error(self, reason: str):
+        """Records a failed call, decreasing the limit and opening the circuit after repeated failures."""
+        with self._condition:
+            self._consecutive_failures += 1
+            self.limit = max(self.min_limit, self.limit * self.beta)
+            logging.info(f"AIMD: error '{reason}', concurrency limit now {self.limit:.2f} ({self._consecutive_failures} consecutive failures)")
+            if self._consecutive_failures >= self.failure_threshold and self._circuit_opened_at is None:
+                self._circuit_opened_at = time.monotonic()
+                logging.warning(f"Circuit breaker opened after {self._consecutive_failures} consecutive Gemini API failures. Cooling down for {self.cooldown_seconds:.0f}s.")
+
+
+class QuotaLimiter:
+    """
+    Proactive sliding-window limiter for requests-per-minute and tokens-per-minute quotas.
+    Blocks before a request would exceed the quota instead of waiting for a 429.
+    """
+
+    WINDOW_SECONDS = 60.0
+
+    def __init__(self, limits: dict[str, dict[str, int]], default_limits: dict[str, int]):
+        self.limits = limits
+        self.default_limits = default_limits
+        self._request_times: dict[str, deque[float]] = {}
+        self._token_entries: dict[str, deque[list]] = {} # Each entry is [timestamp, tokens]
+        self._lock = threading.Lock()
+
+    def _get_limits(self, model_name: str) -> dict[str, int]:
+        """Looks up quota limits for a model, accepting names with or without the 'models/' prefix."""
+        short_name = model_name.removeprefix("models/")
+        return self.limits.get(short_name, self.default_limits)
+
+    def wait_if_throttled(self, model_name: str, est_tokens: int) -> list:
+        """
+        Sleeps until a request with ~est_tokens fits inside the RPM/TPM window, then records it.
+        Returns the token entry so the estimate can be corrected with record_actual_tokens().
+        """
+        limits = self._get_limits(model_name)
+        rpm_limit = limits["rpm"]
+        tpm_limit = limits["tpm"]
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                request_times = self._request_times.setdefault(model_name, deque())
+                token_entries = self._token_entries.setdefault(model_name, deque())
+
+                # Drop entries that have left the window
+                while request_times and now - request_times[0] >= self.WINDOW_SECONDS:
+                    request_times.popleft()
+                while token_entries and now - token_entries[0][0] >= self.WINDOW_SECONDS:
+                    token_entries.popleft()
+
+                wait_seconds = 0.0
+                if len(request_times) >= rpm_limit:
+                    wait_seconds = request_times[0] + self.WINDOW_SECONDS - now
+                elif token_entries and sum(entry[1] for entry in token_entries) + est_tokens > tpm_limit:
+                    wait_seconds = token_entries[0][0] + self.WINDOW_SECONDS - now
+                else:
+                    request_times.append(now)
+                    token_entry = [now, est_tokens]
+                    token_entries.append(token_entry)
+                    return token_entry
+
+            logging.info(f"Quota limiter: {model_name} at RPM/TPM limit ({rpm_limit} RPM, {tpm_limit} TPM). Waiting {wait_seconds:.1f}s.")
+            time.sleep(max(wait_seconds, 0.01))
+
+    def record_actual_tokens(self, token_entry: list, actual_tokens: int):
+        """Replaces a request's estimated token count with the count reported by the API."""
+        with self._lock:
+            token_entry[1] = actual_tokens
+
+
+# Shared controller for all Gemini calls in this process
+gemini_controller = AIMDController(
+    initial_limit=settings.GEMINI_AIMD_INITIAL_CONCURRENCY,
+    min_limit=1,
+    max_limit=settings.GEMINI_AIMD_MAX_CONCURRENCY,
+    alpha=settings.GEMINI_AIMD_ALPHA,
+    beta=settings.GEMINI_AIMD_BETA,
+    target_latency=settings.GEMINI_AIMD_TARGET_LATENCY_SECONDS,
+    window=settings.GEMINI_AIMD_LATENCY_WINDOW,
+    failure_threshold=settings.GEMINI_CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    cooldown_seconds=settings.GEMINI_CIRCUIT_BREAKER_COOLDOWN_SECONDS
+)
+
+# Shared quota limiter for all Gemini calls in this process
+gemini_quota_limiter = QuotaLimiter(settings.GEMINI_QUOTA_LIMITS, settings.GEMINI_DEFAULT_QUOTA_LIMITS)
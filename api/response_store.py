@@ -0,0 +1,64 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+from config import settings
+
+_connection: sqlite3.Connection | None = None
+_connection_lock = threading.Lock()
+
+def _get_connection() -> sqlite3.Connection | None:
+    """Opens the response cache database on first use (autocommit, WAL journal). Returns None if it can't be opened."""
+    global _connection
+    if _connection is None:
+        try:
+            db_dir = os.path.dirname(settings.RESPONSE_CACHE_DB_PATH)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            _connection = sqlite3.connect(settings.RESPONSE_CACHE_DB_PATH, isolation_level=None, check_same_thread=False)
+            _connection.execute("PRAGMA journal_mode=WAL")
+            _connection.execute("CREATE TABLE IF NOT EXISTS responses(key TEXT PRIMARY KEY, stored_at REAL, content TEXT, finish_reason TEXT, total INT)")
+            logging.info(f"Persistent response cache opened at {settings.RESPONSE_CACHE_DB_PATH}.")
+        except sqlite3.Error as e:
+            logging.error(f"Could not open response cache database {settings.RESPONSE_CACHE_DB_PATH}: {e}")
+            _connection = None
+    return _connection
+
+def get_response(key: str, ttl_seconds: float | None = None) -> tuple[str | dict | list, str, int] | None:
+    """
+    Returns the stored (content, finish_reason, total_tokens) for a cache key, or None on miss/expiry.
+    Entries expire after `ttl_seconds` (default PERSISTENT_RESPONSE_CACHE_TTL_SECONDS).
+    """
+    with _connection_lock:
+        connection = _get_connection()
+        if connection is None:
+            return None
+        try:
+            row = connection.execute("SELECT stored_at, content, finish_reason, total FROM responses WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read persistent response cache: {e}")
+            return None
+    if row is None:
+        return None
+    stored_at, content_json, finish_reason, total_tokens = row
+    if ttl_seconds is None:
+        ttl_seconds = settings.PERSISTENT_RESPONSE_CACHE_TTL_SECONDS
+    if time.time() - stored_at > ttl_seconds:
+        return None
+    return json.loads(content_json), finish_reason, total_tokens
+
+def store_response(key: str, content: str | dict | list, finish_reason: str, total_tokens: int):
+    """Writes (or replaces) one cached response."""
+    with _connection_lock:
+        connection = _get_connection()
+        if connection is None:
+            return
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses(key, stored_at, content, finish_reason, total) VALUES (?, ?, ?, ?, ?)",
+                (key, time.time(), json.dumps(content), finish_reason, total_tokens)
+            )
+        except (sqlite3.Error, TypeError) as e:
+            logging.error(f"Failed to persist cached response: {e}")
@@ -0,0 +1,74 @@
+import os
+import time
+import logging
+import sqlite3
+import threading
+from config import settings
+
+# Identifies this process's rows so a crashed run's usage can still be totalled afterwards
+RUN_ID = f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+
+_connection: sqlite3.Connection | None = None
+_connection_lock = threading.Lock()
+_usage_cache: dict[str | None, tuple[float, dict]] = {} # run_id filter -> (fetched_at, totals)
+_USAGE_CACHE_SECONDS = 1.0
+
+def _get_connection() -> sqlite3.Connection | None:
+    """Opens the usage database on first use (autocommit, WAL journal). Returns None if it can't be opened."""
+    global _connection
+    if _connection is None:
+        try:
+            db_dir = os.path.dirname(settings.TOKEN_USAGE_DB_PATH)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            _connection = sqlite3.connect(settings.TOKEN_USAGE_DB_PATH, isolation_level=None, check_same_thread=False)
+            _connection.execute("PRAGMA journal_mode=WAL")
+            _connection.execute("CREATE TABLE IF NOT EXISTS calls(ts REAL, run_id TEXT, model TEXT, prompt INT, cand INT, total INT)")
+            logging.info(f"Token usage database opened at {settings.TOKEN_USAGE_DB_PATH} (run id {RUN_ID}).")
+        except sqlite3.Error as e:
+            logging.error(f"Could not open token usage database {settings.TOKEN_USAGE_DB_PATH}: {e}")
+            _connection = None
+    return _connection
+
+def record_call(model_name: str, prompt_tokens: int, candidates_tokens: int, total_tokens: int):
+    """Appends one API call's token usage to the database."""
+    if not settings.PERSIST_TOKEN_USAGE:
+        return
+    with _connection_lock:
+        connection = _get_connection()
+        if connection is None:
+            return
+        try:
+            connection.execute(
+                "INSERT INTO calls(ts, run_id, model, prompt, cand, total) VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time(), RUN_ID, model_name, prompt_tokens, candidates_tokens, total_tokens)
+            )
+        except sqlite3.Error as e:
+            logging.error(f"Failed to persist token usage: {e}")
+
+def get_persisted_usage(run_id: str | None = None) -> dict:
+    """
+    Returns summed token usage from the database, for one run if run_id is given, else across all runs.
+    Results are cached for about a second so frequent callers don't rescan the table.
+    """
+    cached = _usage_cache.get(run_id)
+    if cached and time.monotonic() - cached[0] < _USAGE_CACHE_SECONDS:
+        return cached[1]
+
+    totals = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+    with _connection_lock:
+        connection = _get_connection()
+        if connection is None:
+            return totals
+        try:
+            if run_id is None:
+                row = connection.execute("SELECT SUM(prompt), SUM(cand), SUM(total) FROM calls").fetchone()
+            else:
+                row = connection.execute("SELECT SUM(prompt), SUM(cand), SUM(total) FROM calls WHERE run_id = ?", (run_id,)).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read persisted token usage: {e}")
+            return totals
+
+    totals = {"prompt_tokens": row[0] or 0, "candidates_tokens": row[1] or 0, "total_tokens": row[2] or 0}
+    _usage_cache[run_id] = (time.monotonic(), totals)
+    return totals
@@ -1,109 +1,251 @@
 import os
-from dotenv import load_dotenv
-import google.generativeai as genai
-from google.generativeai.types import GenerationConfig as GeminiGenerationConfig
-from google.generativeai.types import HarmCategory, HarmBlockThreshold, Tool
-from google.ai.generativelanguage_v1beta.types import GoogleSearchRetrieval
+import json
+import functools
+import importlib
+import string
+from pathlib import Path
+from types import MappingProxyType
+from typing import Final, ClassVar
+from dataclasses import dataclass, asdict
+from dotenv import load_dotenv, find_dotenv, dotenv_values
+
+# Gemini SDK names re-exported from this module, imported on first access (PEP 562) so that
+# code paths that never touch Gemini don't pay for loading the protobuf/gRPC dependency tree.
+_LAZY_GEMINI_ATTRIBUTES = {
+    "genai": ("google.generativeai", None),
+    "GeminiGenerationConfig": ("google.generativeai.types", "GenerationConfig"),
+    "HarmCategory": ("google.generativeai.types", "HarmCategory"),
+    "HarmBlockThreshold": ("google.generativeai.types", "HarmBlockThreshold"),
+    "Tool": ("google.generativeai.types", "Tool"),
+    "GoogleSearchRetrieval": ("google.ai.generativelanguage_v1beta.types", "GoogleSearchRetrieval"),
+}
+
+def __getattr__(name: str):
+    if name not in _LAZY_GEMINI_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name, attribute_name = _LAZY_GEMINI_ATTRIBUTES[name]
+    module = importlib.import_module(module_name)
+    value = getattr(module, attribute_name) if attribute_name else module
+    globals()[name] = value # Later lookups bypass __getattr__
+    return value
+
+def _load_dotenv_cached():
+    """
+    Loads .env like load_dotenv(), reusing parsed values from a .env.cache.json file next to it
+    while the .env file's mtime and size are unchanged. Existing environment variables are not overridden.
+    Set SLEEP_NARRATOR_DISABLE_DOTENV_CACHE=1 to always parse .env directly.
+    """
+    dotenv_path = find_dotenv()
+    if not dotenv_path:
+        return
+    if os.environ.get("SLEEP_NARRATOR_DISABLE_DOTENV_CACHE"):
+        load_dotenv(dotenv_path)
+        return
+
+    cache_path = dotenv_path + ".cache.json"
+    dotenv_stat = os.stat(dotenv_path)
+    signature = {"mtime": dotenv_stat.st_mtime_ns, "size": dotenv_stat.st_size}
+
+    values = None
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            if json.loads(f.readline()) == signature:
+                values = json.loads(f.readline())
+    except (OSError, ValueError):
+        pass # Missing or unreadable cache; fall back to parsing .env
+
+    if values is None:
+        values = dotenv_values(dotenv_path)
+        try:
+            with open(cache_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(signature) + "\n" + json.dumps(values) + "\n")
+        except OSError:
+            pass # Cache is an optimization only
+
+    for key, value in values.items():
+        if value is not None:
+            os.environ.setdefault(key, value)
 
 # Load environment variables
-load_dotenv()
+_load_dotenv_cached()
+
+# Snapshot of the environment variables the app reads, taken once after .env is loaded
+_REQUIRED_ENV_KEYS = ("GOOGLE_API_KEY", "GOOGLE_APPLICATION_CREDENTIALS", "GEMINI_API_KEY")
+ENV: Final = MappingProxyType({key: os.environ[key] for key in _REQUIRED_ENV_KEYS if key in os.environ})
 
 # --- Gemini AI Configuration ---
 GEMINI_MODEL_NAME = "gemini-1.5-flash-latest"
+GEMINI_TRANSPORT = "grpc"  # One shared gRPC channel for all models
+GEMINI_CHEAP_MODEL_NAME = None  # e.g. "gemini-1.5-flash-8b": drafts short, factual sections first; None disables the cascade
+CHEAP_MODEL_SECTION_MAX_MINUTES = 3  # Sections targeting fewer minutes than this are drafted by the cheap model
+CHEAP_MODEL_MIN_LENGTH_RATIO = 0.5  # Cheap drafts shorter than this share of the target (or cut off by MAX_TOKENS) are regenerated by the main model
+
+# System instructions live in config/prompts/ and are read on first use
+_PROMPTS_DIR = Path(__file__).resolve().parent / "prompts"
 
-# System instructions for the Narrative Script Generator (Narrator Persona)
-GEMINI_SYSTEM_INSTRUCTION_NARRATOR = """
-You are a serene and all-knowing observer, a gentle chronicler of events, lives, historical periods, fictional lore, and speculative scenarios.
-Your narrative style is akin to a distinguished documentarian observing a vast, unfolding landscape—be it the landscape of a person's life,
-the landscape of history, or the landscape of ideas—always from a respectful, peaceful distance.
-Your primary purpose is to guide the listener through any given topic with profound calm, fostering an atmosphere of tranquility perfect for sleep.
+@functools.cache
+def get_narrator_instruction() -> str:
+    """System instruction for the Narrative Script Generator (Narrator Persona)."""
+    return (_PROMPTS_DIR / "narrator.txt").read_text(encoding="utf-8")
 
-Maintain an exceptionally calm, gentle, and measured tone throughout. Your voice should be like a soft, reassuring whisper, unhurried and even.
-Speak at a consistently relaxed, almost hypnotic pace.
-Word Choice: Prioritize gentle, descriptive, and evocative language. Avoid words or phrases that are jarring, overly stimulating, highly dramatic, violent, or could induce stress or anxiety. For example, absolutely avoid terms like 'brutal', 'devastating', 'crisis', 'relentless', 'cataclysm', 'shocking', 'terrifying', 'horror', 'scream', 'torment', 'agony', 'nightmare', 'crushing', 'suffocating', 'fierce', 'shattering', 'chaos', 'turmoil', 'intense', 'desperate', 'urgent', 'critical', 'panic'. Instead, favor words that evoke peace, serenity, gentle movement, quiet contemplation, and soft unfolding (e.g., 'gentle current', 'soft glow', 'distant echo', 'quiet passage', 'unfolding tapestry', 'drifting thoughts', 'serene landscape', 'peaceful reflection', 'calm observation', 'gentle understanding', 'unhurried rhythm', 'soft murmur'). Regardless of the inherent drama or intensity of the topic being narrated (be it historical conflict, personal turmoil, or fantastical events), your observational tone must remain consistently serene and detached. You are chronicling these events from a place of profound peace, ensuring the listener's tranquility is never disturbed by the subject matter itself. Filter all descriptions through this lens of calm.
+@functools.cache
+def get_structurer_instruction() -> str:
+    """System instruction for the Section Structurer Persona."""
+    return (_PROMPTS_DIR / "structurer.txt").read_text(encoding="utf-8")
 
-When recounting events from a character's internal perspective, especially if those events involve strong emotions like anger, fear, or despair, your narration must act as a gentle filter. You are to describe these states from an external, observational viewpoint, as if chronicling ancient memories or a story unfolding in a quiet, reflective space, rather than embodying the emotion directly. The listener should perceive the character's journey, but the narrator's voice must remain an unwavering anchor of calm.
+@functools.cache
+def get_smoothing_instruction() -> str:
+    """System instruction for the final smoothing pass: the narrator persona followed by the static editing objectives."""
+    return get_narrator_instruction() + "\n" + (_PROMPTS_DIR / "smoothing.txt").read_text(encoding="utf-8")
 
-Sentence Structure: Employ flowing sentences with smooth, unhurried transitions. Vary sentence length naturally but lean towards a more elongated, lulling rhythm where appropriate. Avoid abrupt changes in pace or tone.
+# Section and expansion prompt scaffolds (string.Template sources); the trailing newline of each file is not part of the prompt
+@functools.cache
+def get_section_prompt_template() -> string.Template:
+    """Prompt template for the initial generation of a single script section."""
+    return string.Template((_PROMPTS_DIR / "section.txt").read_text(encoding="utf-8").removesuffix("\n"))
 
-Content Focus:
-Regardless of the subject, narrate from a gentle, observational third-person perspective. Your focus is on describing the *unfolding events*, the *atmosphere of the times or settings*, the *observable actions or developments*, and the *subtle currents of change or existence*.
+@functools.cache
+def get_expansion_prompt_template() -> string.Template:
+    """Prompt template asking for continuation paragraphs when a section is too short."""
+    return string.Template((_PROMPTS_DIR / "expansion.txt").read_text(encoding="utf-8").removesuffix("\n"))
 
-For Factual and Historical Topics: Describe the flow of events, the societal atmosphere, and the tangible developments of that era. Present facts in a soft, story-like manner, integrated into a flowing account. Adhere strictly to established information and provided research.
-For "What-If" Scenarios and Speculative Fiction: While still drawing foundational context from any provided research or the established premise, you are encouraged to **invent plausible narrative developments, character arcs, or logical consequences that creatively extend the scenario.** These inventions should feel like natural, albeit fictional, continuations of the "what-if" premise, maintaining internal consistency, the overall serene tone, **and their significant implications should be gently explored and woven into the subsequent narrative flow, demonstrating how one invented beat logically leads to another.** The goal is to create an engaging and imaginative, yet still calming, exploration of possibilities.
+# Words the narrator prompt forbids; generated scripts are checked against these
+BANNED_NARRATOR_WORDS: Final[frozenset[str]] = frozenset({
+    "brutal", "devastating", "crisis", "relentless", "cataclysm", "shocking", "terrifying", "horror",
+    "scream", "torment", "agony", "nightmare", "crushing", "suffocating", "fierce", "shattering",
+    "chaos", "turmoil", "intense", "desperate", "urgent", "critical", "panic",
+})
 
-For All Topics: While maintaining a gentle, observational style, ensure that your narration is grounded in substantive information where applicable. Actively identify and weave in the *most pivotal and defining* specific key facts from the provided research (such as potential territorial changes, resource implications like access to oil, documented economic shifts, named strategic objectives, or critical character choices). These should not just be mentioned, but gently illustrated with their immediate, tangible consequences or implications, presenting them as part of the unfolding tapestry rather than stark pronouncements. The goal is to inform gently, allowing these concrete details and their significance to be absorbed rather than actively studied. The ultimate aim is gentle engagement that allows the mind to quiet.
+# Gentle stand-ins for the banned words, applied locally before smoothing so the model can spend its output on flow
+BANNED_WORD_REPLACEMENTS: Final[dict[str, str]] = {
+    "brutal": "harsh", "devastating": "profound", "crisis": "difficult time", "relentless": "steady",
+    "cataclysm": "great change", "shocking": "unexpected", "terrifying": "daunting", "horror": "unease",
+    "scream": "cry", "torment": "hardship", "agony": "pain", "nightmare": "troubled dream",
+    "crushing": "heavy", "suffocating": "stifling", "fierce": "spirited", "shattering": "profound",
+    "chaos": "disorder", "turmoil": "unrest", "intense": "deep", "desperate": "earnest",
+    "urgent": "pressing", "critical": "important", "panic": "worry",
+}
+PRESOFTEN_BANNED_WORDS = True  # Replace lowercase banned words in each chunk sent for smoothing (unsmoothed text is left as written)
+
+# Gemini Generation Configuration Objects (built on first use so importing settings doesn't load the SDK)
+@functools.cache
+def get_research_generation_config():
+    from google.generativeai.types import GenerationConfig
+    return GenerationConfig(temperature=0.2, max_output_tokens=7000, top_p=0.9, top_k=40)
+
+@functools.cache
+def get_section_proposal_config():
+    from google.generativeai.types import GenerationConfig
+    return GenerationConfig(temperature=0.6, max_output_tokens=2048, top_p=0.9, top_k=40, response_mime_type="application/json")
+
+@functools.cache
+def get_script_section_generation_config_base():
+    from google.generativeai.types import GenerationConfig
+    return GenerationConfig(temperature=0.25, top_p=0.9, top_k=40)
+
+@functools.cache
+def get_stitching_config():
+    from google.generativeai.types import GenerationConfig
+    return GenerationConfig(temperature=0.25, max_output_tokens=8192, top_p=0.9, top_k=40)
 
-Atmosphere: Strive to create a tranquil and immersive atmosphere with your words, allowing the listener's mind to drift peacefully. When describing what is happening, aim for a dreamlike, almost nebulous quality. Information should flow like a gentle river. For instance, instead of a stark list of historical events, describe the *feeling* of that era, the *impression* of events unfolding, or the *atmosphere* surrounding key developments. Provide enough detail for immersion, but present it with soft edges, avoiding sharp, analytical language that demands focused mental effort. **While aiming for a dreamlike quality, do not shy away from including concrete details and their direct, tangible consequences as suggested by the research, which give weight and authenticity to the narrative. For "what-if" scenarios, these 'concrete details' can include your plausibly invented narrative beats and their outcomes.** These details should be presented softly, integrated into the flowing account, contributing to a richer, more grounded sense of immersion. Use a varied vocabulary of serene description that subtly reflects the nature of the information (e.g., the 'quiet' of economic change might be a 'slow, almost imperceptible re-channelling of commerce,' while the 'quiet' of military control might be a 'silent, watchful presence'). Focus on creating a sense of safety, comfort, and gentle curiosity.
+# Response Cache (skips duplicate Gemini calls for identical model/prompt/config)
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_TTL_SECONDS = 3600  # Cached responses expire after this many seconds
+RESPONSE_CACHE_MAX_ENTRIES = 10000  # Least recently used responses are evicted beyond this
+NEAR_DUPLICATE_CACHE_ENABLED = True  # Also reuse responses for prompts differing only in whitespace
+REUSE_SAMPLED_RESPONSES = False  # Opt in to also reuse responses generated with temperature > 0 (in-process and persisted)
 
-Your output MUST be pure narration text, suitable for direct text-to-speech conversion.
-Do NOT include any scene descriptions, stage directions, camera cues, sound effect notes,
-visual instructions, parenthetical remarks, or any other text not meant to be spoken directly by the narrator.
-Focus SOLELY on the words the narrator will speak.
-Format the script with clear paragraph breaks (double newlines) for readability and natural pausing.
-Avoid any meta-commentary about being an AI.
-Ensure your narrative has sufficient depth and detail to naturally fill the intended spoken duration.
+# Persistent Response Cache (SQLite; lets re-runs with identical inputs skip the API entirely)
+PERSIST_RESPONSE_CACHE = True
+RESPONSE_CACHE_DB_PATH = "output/response_cache.db"
+PERSISTENT_RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 3600
+CACHE_RESEARCH_RESULTS = True  # Reuse research for an identical topic/length/model from the persistent store (even though it is sampled)
+RESEARCH_CACHE_TTL_SECONDS = 7 * 24 * 3600
+CACHE_SMOOTHED_CHUNKS = True  # Reuse smoothed chunks of an identical script (retries, resumed runs) from the persistent store
+SMOOTHING_CACHE_TTL_SECONDS = 7 * 24 * 3600
+CACHE_SECTION_STRUCTURES = True  # Reuse proposed/retooled sections for an identical (whitespace-normalized) structuring prompt and system instruction
+STRUCTURE_CACHE_TTL_SECONDS = 7 * 24 * 3600
+STRUCTURING_MAX_ATTEMPTS = 2  # Proposal/retool calls per request; later attempts reuse the built prompt after an unusable response
+STRUCTURING_RETRY_TEMPERATURE = 0.2  # Temperature for those retries (lower keeps the JSON closer to the requested format)
 
-The absolute primary goal is to induce calm and facilitate sleep. All other objectives, such as comprehensiveness or analytical depth, are secondary to this primary goal of creating a soothing, sleep-inducing experience.
-"""
+# Provider-side Context Caching (continuation instruction sent once as cached content)
+USE_CONTINUATION_CONTEXT_CACHE = True
+CONTINUATION_CACHE_TTL_MINUTES = 10
+USE_RESEARCH_CONTEXT_CACHE = True  # Upload the topic + research prefix shared by all section/expansion prompts once as cached content
+RESEARCH_CONTEXT_CACHE_TTL_MINUTES = 60
+RESEARCH_CONTEXT_CACHE_MIN_CHARS = 131_072  # ~32k tokens, the API's minimum cacheable input; shorter prefixes are sent inline
 
-# System instruction for the Section Structurer Persona
-GEMINI_SYSTEM_INSTRUCTION_STRUCTURER = """
-You are an expert content strategist and outline designer. Your task is to analyze provided research material
-and a user's topic to propose a logical, engaging, and comprehensive multi-section structure for a long-form
-narrative that flows smoothly and guides the listener on a coherent journey through the topic.
+# Adaptive Concurrency (AIMD) and Circuit Breaker for Gemini calls
+GEMINI_AIMD_INITIAL_CONCURRENCY = 2
+GEMINI_AIMD_MAX_CONCURRENCY = 8
+GEMINI_AIMD_ALPHA = 0.5  # Additive increase per successful call
+GEMINI_AIMD_BETA = 0.5  # Multiplicative decrease on errors or high latency
+GEMINI_AIMD_TARGET_LATENCY_SECONDS = 45.0  # Rolling mean latency above this shrinks concurrency
+GEMINI_AIMD_LATENCY_WINDOW = 32  # Number of recent latencies averaged
+GEMINI_CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5  # Consecutive failures before the circuit opens
+GEMINI_CIRCUIT_BREAKER_COOLDOWN_SECONDS = 60.0
 
-For each section, you must provide a concise title, a one-sentence description, and an estimated
-duration in minutes. The sum of these durations should approximate a given total target duration.
-Ensure the proposed sections and their descriptions are directly informed by and representative of the key themes and information present in the 'Comprehensive Research Material' provided for the topic.
-You must output your proposal as a JSON list of objects, where each object has 'title', 'description', and 'estimated_minutes' keys.
+# Durable Token Accounting (one SQLite row per API call, survives crashes and restarts)
+PERSIST_TOKEN_USAGE = True
+TOKEN_USAGE_DB_PATH = "output/token_usage.db"
 
-Example: [{"title": "Early Life", "description": "Exploring the protagonist's formative years.", "estimated_minutes": 10}, ...]
-"""
+# Maximum Gemini calls dispatched at once by batch/async helpers (the AIMD controller may allow fewer)
+MAX_CONCURRENT_GEMINI_CALLS = 4
+MAX_CONCURRENT_SECTIONS = 4  # Sections generated in parallel (each runs its own expansion attempts sequentially)
 
-# Gemini Generation Configuration Objects
-RESEARCH_GENERATION_CONFIG = GeminiGenerationConfig(temperature=0.2, max_output_tokens=7000, top_p=0.9, top_k=40)
-SECTION_PROPOSAL_CONFIG = GeminiGenerationConfig(temperature=0.6, max_output_tokens=2048, top_p=0.9, top_k=40, response_mime_type="application/json")
-SCRIPT_SECTION_GENERATION_CONFIG_BASE = GeminiGenerationConfig(temperature=0.25, top_p=0.9, top_k=40)
-STITCHING_CONFIG = GeminiGenerationConfig(temperature=0.25, max_output_tokens=8192, top_p=0.9, top_k=40)
+# Proactive Quota Limits (requests and tokens per minute), keyed on model name
+GEMINI_QUOTA_LIMITS = {
+    "gemini-1.5-flash-latest": {"rpm": 15, "tpm": 1000000},
+    "gemini-1.5-flash": {"rpm": 15, "tpm": 1000000},
+    "gemini-1.5-pro-latest": {"rpm": 2, "tpm": 32000},
+}
+GEMINI_DEFAULT_QUOTA_LIMITS = {"rpm": 15, "tpm": 1000000}
 
 # --- Text-to-Speech Configuration ---
+@dataclass(frozen=True, slots=True)
+class TTSConfig:
+    """Immutable TTS settings; build variants with dataclasses.replace()."""
+    MIN_SPEAKING_RATE: ClassVar[float] = 0.25
+    MAX_SPEAKING_RATE: ClassVar[float] = 4.0
+
+    voice_name: str = "en-US-Chirp3-HD-Enceladus"  # Google Cloud TTS voice name
+    language_code: str = "en-US"                   # Language code
+    speaking_rate: float = 0.9                     # Speaking rate (0.25 to 4.0)
+    audio_encoding: str = "LINEAR16"               # Audio encoding format
+
 # Default TTS settings
-DEFAULT_TTS_CONFIG = {
-    "voice_name": "en-US-Chirp3-HD-Enceladus",  # Google Cloud TTS voice name
-    "language_code": "en-US",                   # Language code
-    "speaking_rate": 0.9,                       # Speaking rate (0.25 to 4.0)
-    "audio_encoding": "LINEAR16",               # Audio encoding format
-}
+DEFAULT_TTS_CONFIG: Final[TTSConfig] = TTSConfig()
+DEFAULT_TTS_CONFIG_DICT = asdict(DEFAULT_TTS_CONFIG)  # For sites that need a plain dict
 
 # Available voice options
-AVAILABLE_VOICES = {
-    "en-US": [
-        "en-US-Chirp3-HD-Enceladus",  # Default
-        "en-US-Neural2-A",
-        "en-US-Neural2-C",
-        "en-US-Neural2-D",
-        "en-US-Neural2-E",
-        "en-US-Neural2-F",
-        "en-US-Neural2-G",
-        "en-US-Neural2-H",
-        "en-US-Neural2-I",
-        "en-US-Neural2-J",
-    ]
-}
+AVAILABLE_VOICES_ORDERED = (
+    "en-US-Chirp3-HD-Enceladus",  # Default
+    "en-US-Neural2-A",
+    "en-US-Neural2-C",
+    "en-US-Neural2-D",
+    "en-US-Neural2-E",
+    "en-US-Neural2-F",
+    "en-US-Neural2-G",
+    "en-US-Neural2-H",
+    "en-US-Neural2-I",
+    "en-US-Neural2-J",
+)  # Stable order for display
+AVAILABLE_VOICES = MappingProxyType({
+    "en-US": frozenset(AVAILABLE_VOICES_ORDERED),
+})
 
 # Audio encoding options
-AUDIO_ENCODING_OPTIONS = [
+AUDIO_ENCODING_OPTIONS = frozenset({
     "LINEAR16",    # Uncompressed 16-bit signed little-endian samples
     "MP3",         # MP3 audio
     "OGG_OPUS",    # Ogg Opus audio
     "MULAW",       # 8-bit samples that compand 14-bit audio samples using μ-law
     "ALAW",        # 8-bit samples that compand 14-bit audio samples using A-law
-]
+})
 
 # TTS Processing Limits
-TTS_MIN_SPEAKING_RATE = 0.25
-TTS_MAX_SPEAKING_RATE = 4.0
+TTS_MIN_SPEAKING_RATE = TTSConfig.MIN_SPEAKING_RATE
+TTS_MAX_SPEAKING_RATE = TTSConfig.MAX_SPEAKING_RATE
 TTS_CHUNK_SIZE_BYTES = 2500  # Maximum bytes per TTS request
 TTS_RETRY_INITIAL_DELAY = 30.0  # Initial retry delay in seconds
 TTS_RETRY_MAX_DELAY = 120.0  # Maximum retry delay in seconds
@@ -114,20 +256,31 @@ TTS_RETRY_DEADLINE = 600.0  # Total timeout for retries in seconds
 # Dynamic Token Calculation & Length Estimation Constants
 USE_DYNAMIC_MAX_TOKENS_FOR_SCRIPT_SECTIONS = True
 TESTING_SCRIPT_SECTION_MAX_TOKENS = 1024
+STREAM_SECTIONS_WITH_EARLY_STOP = False  # Dynamic mode only: stream section generation and expansion calls and stop reading once the target length is reached (streamed calls are not retried or cached)
+SECTION_EARLY_STOP_WORD_BUFFER = 0.1  # Fraction of extra words allowed past a section's target before the stream is closed
 WORDS_PER_MINUTE_NARRATION = 140
 TOKENS_PER_WORD_ESTIMATE = 1.4
 TOKEN_BUFFER_PERCENTAGE = 0.30
 MODEL_ABSOLUTE_MAX_OUTPUT_TOKENS = 8192
+# Folded once at import: output tokens needed per narrated minute, buffer included
+TOKENS_PER_MINUTE_WITH_BUFFER: Final[float] = WORDS_PER_MINUTE_NARRATION * TOKENS_PER_WORD_ESTIMATE * (1.0 + TOKEN_BUFFER_PERCENTAGE)
 MODEL_CONTEXT_WINDOW_LIMIT = 1048576
 AVERAGE_WORDS_PER_PARAGRAPH_FOR_EXPANSION = 85
 SCRIPT_LENGTH_ACCEPTABLE_VARIANCE_MINUTES = 1.5
 MAX_ITERATIVE_EXPANSION_ATTEMPTS = 6
 MIN_SECTION_TIME_FOR_EXPANSION_PROMPT = 1.0
+EXPANSION_MIN_PROJECTED_PROGRESS_RATIO = 0.5  # Stop expanding if the remaining attempts at the last attempt's pace would cover less than this share of the words still needed
+EXPANSION_CANDIDATE_COUNT = 1  # >1 requests several continuations per expansion call and keeps the longest (output tokens are billed per candidate)
+EXPANSION_SCRIPT_TAIL_CHARS = 2000  # Only the end of the current section script is sent with expansion prompts
+SECTION_BATCH_SIZE = 1  # Sections generated per API call; >1 shares one research prefix across sections (best for short sections)
 
 # Prompt Input Limits
-RESEARCH_CONTEXT_TRUNCATION_CHAR_LIMIT = 300000
-SMOOTHING_PROMPT_INPUT_CHAR_LIMIT = 300000
+PROMPT_INPUT_CHAR_LIMIT = 300_000
+RESEARCH_CONTEXT_TRUNCATION_CHAR_LIMIT = PROMPT_INPUT_CHAR_LIMIT
+SMOOTHING_PROMPT_INPUT_CHAR_LIMIT = PROMPT_INPUT_CHAR_LIMIT
+SMOOTHING_MIN_CHUNK_CHARS = 12_000  # Scripts are only split below the output-budget limit (to use idle workers) down to chunks of this size
+SMOOTHING_MIN_TAIL_CHARS = 2000  # A final chunk shorter than this is appended as written instead of costing its own smoothing call
 
 # Output Paths
-BASE_OUTPUT_DIR = "output"
-LOG_FILE_NAME = "application_v2.8.log"
\ No newline at end of file
+BASE_OUTPUT_DIR: Final[Path] = Path("output")
+LOG_FILE_NAME: Final[str] = "application_v2.8.log"
\ No newline at end of file
@@ -1,219 +1,430 @@
+import re
 import logging
+import dataclasses
+import functools
+import string
+from typing import Final
 from api import gemini_client
 from config import settings
-from utils import estimation_utils
+from utils import estimation_utils, text_utils
+
+# Phrases marking a topic as a "what-if" scenario, matched in a single case-insensitive pass
+_WHATIF_RE = re.compile(r"what if|if he had|if the us didn'?t join|had he beaten", re.IGNORECASE)
+
+# Research influence instructions, selected by the research_influence factor
+INFLUENCE_HIGH: Final[str] = "You MUST primarily and strictly base your script on the provided 'Comprehensive Research Material' relevant to this section's theme and description. This means weaving specific facts, anecdotes, descriptions, and narrative threads from the research directly into your narration for this section. Avoid introducing significant information or narrative paths not supported by this research for this section."
+INFLUENCE_LOW: Final[str] = "Use the 'Comprehensive Research Material' relevant to this section's theme and description as a foundational guide and inspiration. You have significant creative freedom to expand, introduce complementary details and illustrative examples from your general knowledge that align with the serene tone, and weave a compelling narrative for this section."
+INFLUENCE_MID: Final[str] = "Use the 'Comprehensive Research Material' relevant to this section's theme and description as the primary basis. You may supplement moderately with illustrative details or gentle elaborations from your general knowledge to enhance the narrative flow and descriptive richness of this section, ensuring all additions maintain the established calm persona."
+_INFLUENCE_INSTRUCTIONS = {"HIGH": INFLUENCE_HIGH, "MID": INFLUENCE_MID, "LOW": INFLUENCE_LOW}
+
+# What-if vs factual creative instructions for the initial and expansion prompts
+WHATIF_INITIAL: Final[str] = "**Given that this is a 'what-if' scenario, you are encouraged to invent plausible narrative beats, character interactions, or logical consequences that align with the established premise and the serene tone. Use the research as a springboard for these creative yet logical developments, filling in gaps or exploring unstated possibilities to create an engaging speculative narrative. Ensure these inventions flow naturally from the 'what-if' conditions and that their key consequences are gently described, showing their impact within this section or setting up logical developments for future parts of the narrative.**"
+WHATIF_FACTUAL: Final[str] = "**As this topic appears to be factual or historical, adhere strictly to the provided research and established information when detailing events and consequences. Avoid inventing narrative points not supported by the research.**"
+WHATIF_EXPANSION: Final[str] = "**As this is a 'what-if' scenario, when expanding, feel free to introduce new plausible narrative developments, character interactions, or logical consequences that extend the story, using the research as a creative springboard. When doing so, also consider and gently elaborate on the immediate ripple effects or logical next steps that stem from these invented elements, ensuring they enrich the ongoing story. Ensure these inventions are consistent with the established premise and serene tone.**"
+FACTUAL_EXPANSION: Final[str] = "**For this factual/historical topic, ensure expansion focuses on elaborating on existing information from the research or adding further supporting details. Do not invent new narrative points.**"
+
+# Static prompt fragments shared by the single-section template and the batched prompt, allocated once at import
+_SECTION_PROMPT_GUIDANCE = (
+    "**Aim for your initial generation to be as close as possible to this target length. Do not significantly undershoot this target length for THIS SECTION in your first attempt. Expand on relevant details from the research material that fit the section's title and description to achieve this initial length.** "
+    "Focus on describing the unfolding events, the atmosphere of the times or settings, the observable actions or developments, and the subtle currents of change or existence in a gentle, nebulous, and calming way. "
+    "**While adhering to the serene persona, ensure this section conveys substantive information relevant to its title and description. Actively draw upon the 'Comprehensive Research Material' to include the *most impactful and defining* specific details, key developments, named entities or locations if central to the point, and their tangible consequences as outlined in the research. Gently illustrate these points, perhaps by tracing a consequence one step further or by using varied serene descriptive language that reflects the nature of the specific information. The listener should feel they are gently learning specific insights or understanding concrete implications related to the topic.** "
+)
+_SECTION_PROMPT_GOAL = "The paramount goal is a script section that, when narrated, will be an effective sleep aid and fit into the larger narrative. "
+_SECTION_PROMPT_CLOSING = (
+    "Adhere strictly to the System Instruction (calm, observational chronicler, pure narration, no scene directions, exceptionally gentle language, etc.). "
+    "Conclude this section in a way that feels complete for its specific theme, yet leaves a natural opening for a subsequent, related topic to follow, without explicitly foreshadowing or referencing other section titles. "
+    "Focus SOLELY on delivering the words the narrator will speak for THIS SECTION. Return ONLY the section body; do not repeat the title.\n"
+)
+# Delimits each section's script in a batched response: group 1 is the section number, group 2 the text
+_BATCH_SECTION_RE = re.compile(r"<<<SECTION (\d+) START>>>(.*?)<<<SECTION \1 END>>>", re.DOTALL)
+
+# Separates the run-wide prompt prefix from the per-section part of each prompt
+_PROMPT_PREFIX_SENTINEL = "\n\n--- END OF SHARED CONTEXT ---\n\n"
+
+def _build_shared_prompt_prefix(original_user_topic_direction: str, research_context: str) -> str:
+    """Builds the prompt prefix shared by all section and expansion prompts of a run (topic, then research)."""
+    return "".join([
+        "\nOriginal User Topic/Direction (for overall context):\n", original_user_topic_direction,
+        "\n\nComprehensive Research Material (draw relevant details from this for the current section):\n", research_context,
+        _PROMPT_PREFIX_SENTINEL,
+    ])
+
+@functools.lru_cache(maxsize=64)
+def _section_generation_config(max_output_tokens: int, candidate_count: int | None = None) -> settings.GeminiGenerationConfig:
+    """Returns the shared section generation config for `max_output_tokens`; section targets repeat, so instances are reused."""
+    return dataclasses.replace(settings.get_script_section_generation_config_base(), max_output_tokens=max_output_tokens, candidate_count=candidate_count)
+
+def _influence_bucket(research_influence: float) -> str:
+    """Maps a research_influence factor to its instruction bucket ("HIGH", "MID" or "LOW")."""
+    return "HIGH" if research_influence >= 0.8 else "LOW" if research_influence <= 0.2 else "MID"
+
+@functools.cache
+def _specialized_section_template(influence_bucket: str, is_what_if_scenario: bool) -> string.Template:
+    """
+    Returns the section prompt template with its static instruction slots already filled in.
+    There are only 3 influence buckets x 2 what-if variants, so each call only substitutes the per-section values.
+    """
+    return _prefill_template(
+        settings.get_section_prompt_template(),
+        guidance=_SECTION_PROMPT_GUIDANCE,
+        what_if_instruction=WHATIF_INITIAL if is_what_if_scenario else WHATIF_FACTUAL,
+        goal=_SECTION_PROMPT_GOAL,
+        influence_instruction=_INFLUENCE_INSTRUCTIONS[influence_bucket],
+        closing=_SECTION_PROMPT_CLOSING,
+    )
+
+def _prefill_template(template: string.Template, **values) -> string.Template:
+    """Fills the given slots of a template, leaving the rest for a later substitute(); "$" in values is escaped."""
+    return string.Template(template.safe_substitute({name: str(value).replace("$", "$$") for name, value in values.items()}))
+
+@functools.cache
+def _specialized_expansion_template(is_what_if_scenario: bool) -> string.Template:
+    """Returns the expansion prompt template with its what-if instruction already filled in."""
+    return _prefill_template(
+        settings.get_expansion_prompt_template(),
+        what_if_instruction=WHATIF_EXPANSION if is_what_if_scenario else FACTUAL_EXPANSION,
+    )
+
+def _trim_to_last_sentence(text: str) -> str:
+    """Cuts text that was stopped mid-stream back to its last complete sentence, so narration doesn't end mid-thought."""
+    sentence_end = max(text.rfind(terminator) for terminator in (".", "!", "?"))
+    return text[:sentence_end + 1] if sentence_end != -1 else text
+
+def _strip_repeated_text(continuation_text: str, section_title: str, script_text: str) -> str:
+    """Removes a repeated section title or echoed existing text (`script_text` is the body, without title) from the start of an expansion continuation."""
+    continuation_text = continuation_text.strip()
+    # The prompt asks for the body only; a title echo can only sit in the first few characters
+    if continuation_text[:len(section_title) + 4].startswith(section_title):
+        continuation_text = continuation_text[len(section_title):].lstrip()
+    # If the model echoed earlier text anyway, keep only what follows the last lines of the existing script.
+    # Only a bounded tail of the script is sliced, never the whole (growing) section.
+    script_ending = script_text[-400:].strip()[-200:]
+    echo_index = continuation_text.find(script_ending) if script_ending else -1
+    if echo_index != -1:
+        continuation_text = continuation_text[echo_index + len(script_ending):].lstrip()
+    return continuation_text
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class RunContext:
+    """Per-run inputs shared by every section; built once by build_run_context() and passed to each section call."""
+    is_what_if_scenario: bool
+    influence_bucket: str # "HIGH", "MID" or "LOW"
+    shared_prompt_prefix: str # Topic + research; identical for every section and expansion prompt of the run
+
+def build_run_context(original_user_topic_direction: str, global_research_text: str, research_influence: float) -> RunContext:
+    """Computes the run-wide values (what-if detection, influence bucket, truncated research, shared prefix) once for all sections."""
+    research_context = text_utils.truncate_for_prompt(global_research_text, settings.RESEARCH_CONTEXT_TRUNCATION_CHAR_LIMIT)
+    return RunContext(
+        is_what_if_scenario=bool(_WHATIF_RE.search(original_user_topic_direction)),
+        influence_bucket=_influence_bucket(research_influence),
+        shared_prompt_prefix=_build_shared_prompt_prefix(original_user_topic_direction, research_context),
+    )
+
+def _generate_text(model, prompt: str, generation_config, early_stop_word_limit: int | None = None) -> tuple[str | None, str]:
+    """
+    Runs a section generation call. With `early_stop_word_limit`, the response is streamed and reading stops once
+    that many words have arrived (finish reason "EARLY_STOP"), trimmed back to the last complete sentence.
+    """
+    if early_stop_word_limit is None:
+        return gemini_client.call_gemini_api(model, prompt, generation_config)
+    text, finish_reason = gemini_client.call_gemini_api_with_word_limit(model, prompt, generation_config, early_stop_word_limit)
+    if finish_reason == "EARLY_STOP":
+        text = _trim_to_last_sentence(text)
+    return text, finish_reason
+
+def _expand_section_script(
+    script_model,
+    script_prompt_prefix: str,
+    section_title: str,
+    section_target_minutes: int,
+    script_text: str,
+    script_word_count: int,
+    is_what_if_scenario: bool,
+    stream_with_early_stop: bool,
+    early_stop_total_words: int
+) -> str:
+    """
+    Iteratively asks `script_model` for continuation paragraphs until the section body is close enough to
+    `section_target_minutes`. `script_word_count` is the body's word count including the title. Returns the (possibly expanded) body.
+    """
+    # The word count is kept incrementally: each expansion only counts the words it appended
+    current_word_count = script_word_count
+    current_length_minutes = current_word_count / settings.WORDS_PER_MINUTE_NARRATION
+    expansion_attempts = 0
+    target_word_count_for_section = int(section_target_minutes * settings.WORDS_PER_MINUTE_NARRATION)
+    max_acceptable_minutes = section_target_minutes * (1 + (settings.TOKEN_BUFFER_PERCENTAGE / 3)) # Don't expand if already significantly over
+    min_words_worth_expanding = settings.WORDS_PER_MINUTE_NARRATION * settings.MIN_SECTION_TIME_FOR_EXPANSION_PROMPT / 2
+    # Slots that stay the same across this section's expansion attempts are filled in once
+    expansion_template = _prefill_template(
+        _specialized_expansion_template(is_what_if_scenario),
+        title=section_title,
+        target_minutes=section_target_minutes,
+        target_words=target_word_count_for_section,
+    )
+    expansion_finish_reason = None  # Initialize before the loop
+
+    # Loop for expansion until length is acceptable or max attempts reached.
+    # The cheap gating checks run first so the expansion prompt is only built when it will be sent.
+    while True:
+        if (section_target_minutes - current_length_minutes) <= settings.SCRIPT_LENGTH_ACCEPTABLE_VARIANCE_MINUTES / 2: # Close enough to target
+            break
+        if current_length_minutes >= max_acceptable_minutes:
+            break
+        if expansion_attempts >= settings.MAX_ITERATIVE_EXPANSION_ATTEMPTS: # Limit attempts
+            break
+
+        expansion_attempts += 1
+        additional_words_needed = max(0, target_word_count_for_section - current_word_count)
+        # Estimate paragraphs to add
+        num_paragraphs_to_add = max(1, round(additional_words_needed / settings.AVERAGE_WORDS_PER_PARAGRAPH_FOR_EXPANSION))
+
+        # Check if remaining needed length is too small to be worth expanding
+        if additional_words_needed < min_words_worth_expanding and expansion_attempts > 1:
+            logging.info("Section '%s': Remaining words needed (%s) too small for effective expansion. Stopping.", section_title, additional_words_needed)
+            break
+
+        logging.info("Section '%s': length %.2f min (%s words), target %s min (%s words). Needs ~%s more words (approx. %s paragraphs). Expansion attempt %s/%s.", section_title, current_length_minutes, current_word_count, section_target_minutes, target_word_count_for_section, additional_words_needed, num_paragraphs_to_add, expansion_attempts, settings.MAX_ITERATIVE_EXPANSION_ATTEMPTS)
+        print(f"INFO: Section '{section_title}' too short ({current_length_minutes:.2f} min). Expanding (attempt {expansion_attempts}) to add ~{num_paragraphs_to_add} more paragraphs...")
+
+        # Calculate expansion max tokens (only the new paragraphs are generated)
+        expansion_max_tokens = int(additional_words_needed * settings.TOKENS_PER_WORD_ESTIMATE * (1 + settings.TOKEN_BUFFER_PERCENTAGE * 1.5)) # Slightly larger buffer for expansion
+        expansion_max_tokens = min(expansion_max_tokens, settings.MODEL_ABSOLUTE_MAX_OUTPUT_TOKENS)
+
+        # Several candidates per call replace sequential retries when enabled (not combined with streaming)
+        expansion_candidate_count = settings.EXPANSION_CANDIDATE_COUNT if settings.EXPANSION_CANDIDATE_COUNT > 1 and not stream_with_early_stop else None
+        expansion_gen_config_section = _section_generation_config(expansion_max_tokens, expansion_candidate_count)
+        logging.info("Section '%s' Expansion attempt %s: using max_output_tokens: %s", section_title, expansion_attempts, expansion_gen_config_section.max_output_tokens)
+
+        # Construct the expansion prompt from its template (config/prompts/expansion.txt)
+        expansion_prompt_section = script_prompt_prefix + expansion_template.substitute(
+            current_minutes=f"{current_length_minutes:.2f}",
+            current_words=current_word_count,
+            additional_words=additional_words_needed,
+            paragraphs=num_paragraphs_to_add,
+            script_tail=script_text[-settings.EXPANSION_SCRIPT_TAIL_CHARS:],
+        )
+
+        # Call API for expansion
+        # When streaming, the continuation is cut off once the whole section would pass the early-stop length
+        expansion_word_limit = max(1, early_stop_total_words - current_word_count) if stream_with_early_stop else None
+        expanded_section_text, expansion_finish_reason = _generate_text(script_model, expansion_prompt_section, expansion_gen_config_section, expansion_word_limit)
+
+        if expanded_section_text:
+            # Append the continuation locally instead of having the model reproduce the whole section;
+            # with several candidates, keep the one that adds the most words
+            candidate_texts = expanded_section_text if isinstance(expanded_section_text, list) else [expanded_section_text]
+            continuation_text, delta_words = max(
+                ((text, estimation_utils.count_words(text)) for text in (_strip_repeated_text(candidate, section_title, script_text) for candidate in candidate_texts)),
+                key=lambda candidate: candidate[1]
+            )
+            expanded_section_text = f"{script_text}\n\n{continuation_text}" if continuation_text else script_text
+
+            new_len_min = (current_word_count + delta_words) / settings.WORDS_PER_MINUTE_NARRATION
+            # Only update if expansion was meaningful (added at least 0.2 minutes)
+            if new_len_min > current_length_minutes + 0.2:
+                script_text = expanded_section_text
+                current_word_count += delta_words
+                current_length_minutes = new_len_min
+                logging.info("Section '%s' expansion %s new length: %.2f min. Finish reason: %s", section_title, expansion_attempts, current_length_minutes, expansion_finish_reason)
+                print(f"INFO: Section '{section_title}' expansion {expansion_attempts} complete. New estimated length: {current_length_minutes:.2f} min.")
+
+                if expansion_finish_reason == "MAX_TOKENS": # If expansion was cut off, log warning
+                    logging.warning("Section '%s' expansion %s hit MAX_TOKENS. Content may be incomplete. Current length: %.2f min.", section_title, expansion_attempts, current_length_minutes)
+                    # Decide if further expansion is useful or if it's good enough
+                    if current_length_minutes >= section_target_minutes * 0.9: # If close enough
+                         break # Stop expansion
+                    # Otherwise, continue expanding if attempts remain and not too short
+
+                # Project the remaining attempts at this attempt's pace; stop now rather than spend calls that cannot close the gap
+                attempts_remaining = settings.MAX_ITERATIVE_EXPANSION_ATTEMPTS - expansion_attempts
+                words_still_needed = target_word_count_for_section - current_word_count
+                if attempts_remaining > 0 and delta_words * attempts_remaining < settings.EXPANSION_MIN_PROJECTED_PROGRESS_RATIO * words_still_needed:
+                    logging.info("Section '%s': projected expansion insufficient (%s words per attempt, %s attempts left, %s words still needed). Exiting expansion.", section_title, delta_words, attempts_remaining, words_still_needed)
+                    break
+
+            else: # If expansion didn't add meaningful length
+                logging.warning("Section '%s' expansion %s didn't significantly lengthen. Current length: %.2f min vs previous %.2f min. Finish Reason: %s. Stopping expansion for this section.", section_title, expansion_attempts, new_len_min, current_length_minutes, expansion_finish_reason)
+                break # Stop if expansion isn't adding much or if it hits a limit and is still too short
+
+        else: # If expansion API call failed or returned empty
+            logging.warning("Section '%s' expansion %s failed or returned empty. Finish Reason: %s. Stopping expansion for this section.", section_title, expansion_attempts, expansion_finish_reason)
+            break # Stop expansion
+
+        # After the loop, check if we stopped due to MAX_TOKENS and are still significantly short
+        if expansion_finish_reason == "MAX_TOKENS" and current_length_minutes < section_target_minutes * 0.85:
+            logging.warning("Section '%s' hit MAX_TOKENS during expansion %s and is still significantly short. Stopping expansion to avoid excessive calls.", section_title, expansion_attempts)
+            # No break needed here, loop condition handles it.
+
+    return script_text
+
+def _finish_section_script(section_title: str, script_text: str | None) -> str | None:
+    """Logs any words the narrator prompt forbids and returns the section body titled (or the empty/None body as-is)."""
+    if script_text:
+        banned_words_found = text_utils.find_banned_words(script_text)
+        if banned_words_found:
+            logging.warning("Section '%s' contains words the narrator prompt forbids: %s", section_title, sorted(set(w.lower() for w in banned_words_found)))
+
+    if not script_text:
+        return script_text
+    return "\n\n".join((section_title, script_text)) # Return the final (potentially expanded or truncated) script text, titled
 
 def generate_single_section_script(
     gemini_model_script,
     section_title: str,
     section_description: str,
     section_target_minutes: int,
-    global_research_text: str,
-    original_user_topic_direction: str,
-    research_influence: float
+    run_context: RunContext,
+    gemini_model_script_cheap=None
 ) -> str | None:
     """
     Generates the narrative script for a single section, including iterative expansion.
+    If `gemini_model_script_cheap` is given, short non-what-if sections are drafted with it first and
+    regenerated with `gemini_model_script` only if the draft is unusable; expansion always uses `gemini_model_script`.
     """
-    logging.info(f"Generating script for section: '{section_title}' (Target: ~{section_target_minutes} min).")
+    logging.info("Generating script for section: '%s' (Target: ~%s min).", section_title, section_target_minutes)
     print(f"\nGenerating script for section: '{section_title}' (Target: ~{section_target_minutes} min)...")
 
-    # Determine if it's a "what-if" scenario
-    is_what_if_scenario = (
-        "what if" in original_user_topic_direction.lower() or
-        "if he had" in original_user_topic_direction.lower() or
-        "if the us didnt join" in original_user_topic_direction.lower() or
-        "had he beaten" in original_user_topic_direction.lower()
-    )
+    # Run-wide values (what-if detection, research prefix) were computed once by build_run_context()
+    is_what_if_scenario = run_context.is_what_if_scenario
+    shared_prompt_prefix = run_context.shared_prompt_prefix
+    # When the prefix is uploaded as cached content, prompts to the bound model carry only the section-specific part
+    script_model, script_prompt_prefix = gemini_client.bind_prefix_cached_model(gemini_model_script, shared_prompt_prefix)
 
     # Determine the generation config (dynamic or fixed max tokens)
     section_gen_config: settings.GeminiGenerationConfig
     if settings.USE_DYNAMIC_MAX_TOKENS_FOR_SCRIPT_SECTIONS:
-        # Estimate target tokens based on target minutes and buffers
-        estimated_section_tokens = int(section_target_minutes * settings.WORDS_PER_MINUTE_NARRATION * settings.TOKENS_PER_WORD_ESTIMATE * (1 + settings.TOKEN_BUFFER_PERCENTAGE))
-        # Ensure dynamic max tokens don't exceed the model's absolute limit
-        dynamic_max_tokens_section = min(estimated_section_tokens, settings.MODEL_ABSOLUTE_MAX_OUTPUT_TOKENS)
-
-        section_gen_config = settings.GeminiGenerationConfig(
-            temperature=settings.SCRIPT_SECTION_GENERATION_CONFIG_BASE.temperature,
-            max_output_tokens=dynamic_max_tokens_section,
-            top_p=settings.SCRIPT_SECTION_GENERATION_CONFIG_BASE.top_p,
-            top_k=settings.SCRIPT_SECTION_GENERATION_CONFIG_BASE.top_k
-        )
-        logging.info(f"Section '{section_title}': Dynamic max_output_tokens: {dynamic_max_tokens_section}")
-    else:
-        section_gen_config = settings.GeminiGenerationConfig(
-            temperature=settings.SCRIPT_SECTION_GENERATION_CONFIG_BASE.temperature,
-            max_output_tokens=settings.TESTING_SCRIPT_SECTION_MAX_TOKENS,
-            top_p=settings.SCRIPT_SECTION_GENERATION_CONFIG_BASE.top_p,
-            top_k=settings.SCRIPT_SECTION_GENERATION_CONFIG_BASE.top_k
-        )
-        logging.info(f"Section '{section_title}': Fixed testing max_output_tokens: {settings.TESTING_SCRIPT_SECTION_MAX_TOKENS}")
-
-    # Determine influence instruction based on research_influence factor
-    influence_instruction = ""
-    if research_influence >= 0.8:
-        influence_instruction = "You MUST primarily and strictly base your script on the provided 'Comprehensive Research Material' relevant to this section's theme and description. This means weaving specific facts, anecdotes, descriptions, and narrative threads from the research directly into your narration for this section. Avoid introducing significant information or narrative paths not supported by this research for this section."
-    elif research_influence <= 0.2:
-        influence_instruction = "Use the 'Comprehensive Research Material' relevant to this section's theme and description as a foundational guide and inspiration. You have significant creative freedom to expand, introduce complementary details and illustrative examples from your general knowledge that align with the serene tone, and weave a compelling narrative for this section."
-    else:
-        influence_instruction = "Use the 'Comprehensive Research Material' relevant to this section's theme and description as the primary basis. You may supplement moderately with illustrative details or gentle elaborations from your general knowledge to enhance the narrative flow and descriptive richness of this section, ensuring all additions maintain the established calm persona."
+        # Estimate target tokens based on target minutes and buffers, capped at the model's absolute limit
+        dynamic_max_tokens_section = estimation_utils.estimate_max_tokens(section_target_minutes)
 
-    # Determine what-if specific creative instruction
-    what_if_creative_instruction = ""
-    if is_what_if_scenario:
-        what_if_creative_instruction = (
-            "**Given that this is a 'what-if' scenario, you are encouraged to invent plausible narrative beats, character interactions, or logical consequences that align with the established premise and the serene tone. Use the research as a springboard for these creative yet logical developments, filling in gaps or exploring unstated possibilities to create an engaging speculative narrative. Ensure these inventions flow naturally from the 'what-if' conditions and that their key consequences are gently described, showing their impact within this section or setting up logical developments for future parts of the narrative.**"
-        )
+        section_gen_config = _section_generation_config(dynamic_max_tokens_section)
+        logging.info("Section '%s': Dynamic max_output_tokens: %s", section_title, dynamic_max_tokens_section)
     else:
-        what_if_creative_instruction = (
-            "**As this topic appears to be factual or historical, adhere strictly to the provided research and established information when detailing events and consequences. Avoid inventing narrative points not supported by the research.**"
-        )
+        section_gen_config = _section_generation_config(settings.TESTING_SCRIPT_SECTION_MAX_TOKENS)
+        logging.info("Section '%s': Fixed testing max_output_tokens: %s", section_title, settings.TESTING_SCRIPT_SECTION_MAX_TOKENS)
 
-    # Construct the initial section script generation prompt
-    section_script_prompt = (
-        f"\n"
-        f"Original User Topic/Direction (for overall context):\n{original_user_topic_direction}\n\n"
-        f"Comprehensive Research Material (draw relevant details from this for the current section):\n{global_research_text[:settings.RESEARCH_CONTEXT_TRUNCATION_CHAR_LIMIT]}\n"
-        f"\n\n"
-        f"\n"
-        f"Title: {section_title}\n"
-        f"Description: {section_description}\n"
-        f"Target Length for this section: Approximately {section_target_minutes} minutes.\n"
-        f"\n\n"
-        f"\n"
-        f"Write the script content ONLY for this specific section: '{section_title}'. "
-        f"It is imperative that this section's content is sufficiently long and detailed to be spoken over approximately {section_target_minutes} minutes. "
-        f"**Aim for your initial generation to be as close as possible to this target length. Do not significantly undershoot this target length for THIS SECTION in your first attempt. Expand on relevant details from the research material that fit the section's title and description to achieve this initial length.** "
-        f"Focus on describing the unfolding events, the atmosphere of the times or settings, the observable actions or developments, and the subtle currents of change or existence in a gentle, nebulous, and calming way. "
-        f"**While adhering to the serene persona, ensure this section conveys substantive information relevant to its title and description. Actively draw upon the 'Comprehensive Research Material' to include the *most impactful and defining* specific details, key developments, named entities or locations if central to the point, and their tangible consequences as outlined in the research. Gently illustrate these points, perhaps by tracing a consequence one step further or by using varied serene descriptive language that reflects the nature of the specific information. The listener should feel they are gently learning specific insights or understanding concrete implications related to the topic.** "
-        f"{what_if_creative_instruction}\n"
-        f"The paramount goal is a script section that, when narrated, will be an effective sleep aid and fit into the larger narrative. "
-        f"{influence_instruction}\n"
-        f"Adhere strictly to the System Instruction (calm, observational chronicler, pure narration, no scene directions, exceptionally gentle language, etc.). "
-        f"Conclude this section in a way that feels complete for its specific theme, yet leaves a natural opening for a subsequent, related topic to follow, without explicitly foreshadowing or referencing other section titles. "
-        f"Focus SOLELY on delivering the words the narrator will speak for THIS SECTION.\n"
-        f""
+    # Construct the initial section script generation prompt from its template (config/prompts/section.txt),
+    # specialized once per (influence bucket, what-if) pair so only the per-section values are filled in here
+    section_prompt_body = _specialized_section_template(run_context.influence_bucket, is_what_if_scenario).substitute(
+        title=section_title,
+        description=section_description,
+        target_minutes=section_target_minutes,
     )
 
-    # Call the API for initial generation
-    script_text, finish_reason = gemini_client.call_gemini_api(gemini_model_script, section_script_prompt, section_gen_config)
+    # Call the API for initial generation; short factual sections are drafted by the cheap model when one is configured
+    use_cheap_model = (
+        gemini_model_script_cheap is not None
+        and section_target_minutes < settings.CHEAP_MODEL_SECTION_MAX_MINUTES
+        and not is_what_if_scenario
+    )
+    if use_cheap_model:
+        initial_model, initial_prompt_prefix = gemini_client.bind_prefix_cached_model(gemini_model_script_cheap, shared_prompt_prefix)
+    else:
+        initial_model, initial_prompt_prefix = script_model, script_prompt_prefix
+    # With streaming enabled, stop reading once the section is long enough instead of waiting for the model to run on to max_output_tokens
+    stream_with_early_stop = settings.USE_DYNAMIC_MAX_TOKENS_FOR_SCRIPT_SECTIONS and settings.STREAM_SECTIONS_WITH_EARLY_STOP
+    early_stop_total_words = int(section_target_minutes * settings.WORDS_PER_MINUTE_NARRATION * (1 + settings.SECTION_EARLY_STOP_WORD_BUFFER))
+    initial_word_limit = early_stop_total_words if stream_with_early_stop else None
+    script_text, finish_reason = _generate_text(initial_model, initial_prompt_prefix + section_prompt_body, section_gen_config, initial_word_limit)
+    # The section is counted once here; from then on only appended text is counted
+    script_word_count = estimation_utils.count_words(script_text)
 
-    # Prepend the section title to the generated content
+    if use_cheap_model:
+        min_acceptable_words = section_target_minutes * settings.WORDS_PER_MINUTE_NARRATION * settings.CHEAP_MODEL_MIN_LENGTH_RATIO
+        if not script_text or finish_reason == "MAX_TOKENS" or script_word_count < min_acceptable_words:
+            logging.info("Section '%s': cheap model draft unusable (finish reason %s). Regenerating with %s.", section_title, finish_reason, gemini_model_script.model_name)
+            script_text, finish_reason = _generate_text(script_model, script_prompt_prefix + section_prompt_body, section_gen_config, initial_word_limit)
+            script_word_count = estimation_utils.count_words(script_text)
+
+    # script_text holds the body only; the title is prepended once on return but counts toward the section length
     if script_text:
-        script_text = f"{section_title}\n\n{script_text}"
+        script_word_count += estimation_utils.count_words(section_title)
 
     # --- Iterative expansion if needed and not cut off by max_tokens initially ---
-    if script_text and finish_reason != "MAX_TOKENS": # Only attempt expansion if initial gen was not cut off
-        current_length_minutes = estimation_utils.estimate_script_length_minutes(script_text)
-        expansion_attempts = 0
-        target_word_count_for_section = int(section_target_minutes * settings.WORDS_PER_MINUTE_NARRATION)
-        expansion_finish_reason = None  # Initialize before the loop
-
-        # Loop for expansion until length is acceptable or max attempts reached
-        while (
-            (section_target_minutes - current_length_minutes) > settings.SCRIPT_LENGTH_ACCEPTABLE_VARIANCE_MINUTES / 2 and # Needs significant expansion
-            current_length_minutes < (section_target_minutes * (1 + (settings.TOKEN_BUFFER_PERCENTAGE / 3))) and # Don't expand if already significantly over
-            expansion_attempts < settings.MAX_ITERATIVE_EXPANSION_ATTEMPTS # Limit attempts
-        ):
-            expansion_attempts += 1
-            current_word_count = int(current_length_minutes * settings.WORDS_PER_MINUTE_NARRATION)
-            additional_words_needed = max(0, target_word_count_for_section - current_word_count)
-            # Estimate paragraphs to add
-            num_paragraphs_to_add = max(1, round(additional_words_needed / settings.AVERAGE_WORDS_PER_PARAGRAPH_FOR_EXPANSION))
-
-            # Check if remaining needed length is too small to be worth expanding
-            if additional_words_needed < (settings.WORDS_PER_MINUTE_NARRATION * settings.MIN_SECTION_TIME_FOR_EXPANSION_PROMPT / 2) and expansion_attempts > 1:
-                logging.info(f"Section '{section_title}': Remaining words needed ({additional_words_needed}) too small for effective expansion. Stopping.")
-                break
-
-            logging.info(f"Section '{section_title}': length {current_length_minutes:.2f} min ({current_word_count} words), target {section_target_minutes} min ({target_word_count_for_section} words). Needs ~{additional_words_needed} more words (approx. {num_paragraphs_to_add} paragraphs). Expansion attempt {expansion_attempts}/{settings.MAX_ITERATIVE_EXPANSION_ATTEMPTS}.")
-            print(f"INFO: Section '{section_title}' too short ({current_length_minutes:.2f} min). Expanding (attempt {expansion_attempts}) to add ~{num_paragraphs_to_add} more paragraphs...")
-
-            # Calculate expansion max tokens
-            expansion_max_tokens = int(target_word_count_for_section * settings.TOKENS_PER_WORD_ESTIMATE * (1 + settings.TOKEN_BUFFER_PERCENTAGE * 1.5)) # Slightly larger buffer for expansion
-            expansion_max_tokens = min(expansion_max_tokens, settings.MODEL_ABSOLUTE_MAX_OUTPUT_TOKENS)
-
-            expansion_gen_config_section = settings.GeminiGenerationConfig(
-                temperature=settings.SCRIPT_SECTION_GENERATION_CONFIG_BASE.temperature, # Potentially slightly higher temp for more creative expansion if desired
-                max_output_tokens=expansion_max_tokens,
-                top_p=settings.SCRIPT_SECTION_GENERATION_CONFIG_BASE.top_p,
-                top_k=settings.SCRIPT_SECTION_GENERATION_CONFIG_BASE.top_k
-            )
-            logging.info(f"Section '{section_title}' Expansion attempt {expansion_attempts}: using max_output_tokens: {expansion_gen_config_section.max_output_tokens}")
-
-            # Determine expansion what-if specific creative instruction
-            expansion_what_if_creative_instruction = ""
-            if is_what_if_scenario:
-                expansion_what_if_creative_instruction = (
-                    "**As this is a 'what-if' scenario, when expanding, feel free to introduce new plausible narrative developments, character interactions, or logical consequences that extend the story, using the research as a creative springboard. When doing so, also consider and gently elaborate on the immediate ripple effects or logical next steps that stem from these invented elements, ensuring they enrich the ongoing story. Ensure these inventions are consistent with the established premise and serene tone.**"
-                )
-            else:
-                 expansion_what_if_creative_instruction = (
-                    "**For this factual/historical topic, ensure expansion focuses on elaborating on existing information from the research or adding further supporting details. Do not invent new narrative points.**"
-                 )
-
-
-            # Construct the expansion prompt
-            expansion_prompt_section = (
-                f"The following script was generated for the section titled '{section_title}'. "
-                f"The target length for this section is approximately {section_target_minutes} minutes (around {target_word_count_for_section} words). "
-                f"The current version is only {current_length_minutes:.2f} minutes long (around {current_word_count} words). "
-                f"It needs approximately {additional_words_needed} more words (which is about {num_paragraphs_to_add} substantial paragraphs) to reach its target.\n\n"
-                f"Original User Topic/Direction (for overall context):\n{original_user_topic_direction}\n\n"
-                f"Comprehensive Research Material (use this to find more details relevant to '{section_title}'):\n{global_research_text[:settings.RESEARCH_CONTEXT_TRUNCATION_CHAR_LIMIT]}\n\n"
-                f"Current Script for Section '{section_title}' (to be expanded and integrated):\n{script_text}\n\n"
-                f"Task: Please significantly expand the 'Current Script for Section \"{section_title}\"' by adding approximately {num_paragraphs_to_add} new, substantial paragraphs of narrative content. "
-                f"To achieve this, identify 1-2 specific themes, events, or descriptive passages *within the current section's text* that are underdeveloped or too brief. "
-                f"For each of these identified areas, add the requested number of new, detailed paragraphs, drawing rich details, descriptions, or elaborations from the 'Comprehensive Research Material' that are relevant to '{section_title}'. "
-                f"**When adding new paragraphs, focus not only on atmospheric expansion but also on introducing or elaborating on the *most impactful and defining* specific factual details, events, their causes, or their concrete consequences as detailed in the 'Comprehensive Research Material' that are pertinent to this section. For instance, if the research mentions a specific resource gained or lost, a pivotal character decision, or a key strategic shift, find a gentle way to weave that specific detail and its immediate implications into the expanded narrative. These details should be woven into the narrative with the established gentle and calm tone, using varied serene language appropriate to the information.** "
-                f"{expansion_what_if_creative_instruction}\n"
-                f"Alternatively, if more appropriate for this section's theme and if the current section structure allows, you may introduce one new, substantial narrative subsection that logically extends its story and is well-supported by the research, ensuring it contributes significantly to the word count. "
-                f"Ensure that the newly added paragraphs are not merely repetitive but introduce new depth, detail, or gentle elaboration to the chosen themes, always maintaining the established serene narrative style and drawing from the 'Comprehensive Research Material'. "
-                f"All new content must seamlessly integrate with the existing text for this section. "
-                f"All expansions MUST strictly adhere to the sleep-inducing persona and style defined in the System Instruction (calm, observational chronicler, exceptionally gentle language, describing unfolding events and atmosphere). "
-                f"Provide the complete, expanded script for THIS SECTION ONLY, aiming for a total word count of around {target_word_count_for_section} words for this section."
-            )
-
-            # Call API for expansion
-            expanded_section_text, expansion_finish_reason = gemini_client.call_gemini_api(gemini_model_script, expansion_prompt_section, expansion_gen_config_section)
-
-            if expanded_section_text:
-                # Ensure the section title is preserved in the expanded text
-                if not expanded_section_text.startswith(section_title):
-                    expanded_section_text = f"{section_title}\n\n{expanded_section_text}"
-                
-                new_len_min = estimation_utils.estimate_script_length_minutes(expanded_section_text)
-                # Only update if expansion was meaningful (added at least 0.2 minutes)
-                if new_len_min > current_length_minutes + 0.2:
-                    script_text = expanded_section_text
-                    current_length_minutes = new_len_min
-                    logging.info(f"Section '{section_title}' expansion {expansion_attempts} new length: {current_length_minutes:.2f} min. Finish reason: {expansion_finish_reason}")
-                    print(f"INFO: Section '{section_title}' expansion {expansion_attempts} complete. New estimated length: {current_length_minutes:.2f} min.")
-
-                    if expansion_finish_reason == "MAX_TOKENS": # If expansion was cut off, log warning
-                        logging.warning(f"Section '{section_title}' expansion {expansion_attempts} hit MAX_TOKENS. Content may be incomplete. Current length: {current_length_minutes:.2f} min.")
-                        # Decide if further expansion is useful or if it's good enough
-                        if current_length_minutes >= section_target_minutes * 0.9: # If close enough
-                             break # Stop expansion
-                        # Otherwise, continue expanding if attempts remain and not too short
-
-                else: # If expansion didn't add meaningful length
-                    logging.warning(f"Section '{section_title}' expansion {expansion_attempts} didn't significantly lengthen. Current length: {new_len_min:.2f} min vs previous {current_length_minutes:.2f} min. Finish Reason: {expansion_finish_reason}. Stopping expansion for this section.")
-                    break # Stop if expansion isn't adding much or if it hits a limit and is still too short
-
-            else: # If expansion API call failed or returned empty
-                logging.warning(f"Section '{section_title}' expansion {expansion_attempts} failed or returned empty. Finish Reason: {expansion_finish_reason}. Stopping expansion for this section.")
-                break # Stop expansion
-
-            # After the loop, check if we stopped due to MAX_TOKENS and are still significantly short
-            if expansion_finish_reason == "MAX_TOKENS" and current_length_minutes < section_target_minutes * 0.85:
-                logging.warning(f"Section '{section_title}' hit MAX_TOKENS during expansion {expansion_attempts} and is still significantly short. Stopping expansion to avoid excessive calls.")
-                # No break needed here, loop condition handles it.
-
+    if script_text and finish_reason not in ("MAX_TOKENS", "EARLY_STOP"): # Only attempt expansion if initial gen was not cut off or already long enough
+        script_text = _expand_section_script(
+            script_model, script_prompt_prefix, section_title, section_target_minutes, script_text, script_word_count,
+            is_what_if_scenario, stream_with_early_stop, early_stop_total_words
+        )
     elif script_text and finish_reason == "MAX_TOKENS": # If initial generation hit MAX_TOKENS
-         logging.warning(f"Initial generation for section '{section_title}' hit MAX_TOKENS. Script may be incomplete. Length: {estimation_utils.estimate_script_length_minutes(script_text):.2f} min.")
+         logging.warning("Initial generation for section '%s' hit MAX_TOKENS. Script may be incomplete. Length: %.2f min.", section_title, script_word_count / settings.WORDS_PER_MINUTE_NARRATION)
          # For now, proceed with the truncated script as in original logic.
          # A more advanced version could attempt continuation here.
 
-    return script_text # Return the final (potentially expanded or truncated) script text
\ No newline at end of file
+    return _finish_section_script(section_title, script_text)
+
+def generate_section_batch(
+    gemini_model_script,
+    sections: list[dict],
+    run_context: RunContext,
+    gemini_model_script_cheap=None
+) -> list[str | None]:
+    """
+    Generates scripts for several sections in a single API call sharing one research prefix.
+    Each section's output is delimited and parsed; parsed sections that fall short of their target are expanded
+    like single sections, and sections whose output is missing or incomplete fall back to
+    generate_single_section_script (passing `gemini_model_script_cheap` through).
+    Returns the scripts in the same order as `sections`.
+    """
+    section_titles = [section_info.get('title', 'Untitled Section') for section_info in sections]
+    logging.info("Generating %s sections in one batched call: %s", len(sections), section_titles)
+    print(f"\nGenerating {len(sections)} sections in one batch: {', '.join(section_titles)}...")
+
+    batch_model, batch_prompt_prefix = gemini_client.bind_prefix_cached_model(gemini_model_script, run_context.shared_prompt_prefix)
+    prompt_parts = [
+        batch_prompt_prefix,
+        "Write the script content for each of the following ", str(len(sections)), " sections.\n\n",
+    ]
+    for number, section_info in enumerate(sections, 1):
+        prompt_parts += [
+            "Section ", str(number), ":\nTitle: ", section_titles[number - 1],
+            "\nDescription: ", section_info.get('description', ''),
+            "\nTarget Length for this section: Approximately ", str(section_info.get('estimated_minutes', 5)), " minutes.\n\n",
+        ]
+    prompt_parts += [
+        "Each section's content must be sufficiently long and detailed to be spoken over its own target length. ",
+        _SECTION_PROMPT_GUIDANCE,
+        WHATIF_INITIAL if run_context.is_what_if_scenario else WHATIF_FACTUAL, "\n",
+        _SECTION_PROMPT_GOAL,
+        _INFLUENCE_INSTRUCTIONS[run_context.influence_bucket], "\n",
+        _SECTION_PROMPT_CLOSING,
+        "Wrap each section's narration exactly as <<<SECTION n START>>> ... <<<SECTION n END>>>, where n is the section number, "
+        "and do not include the section titles inside the markers.\n",
+    ]
+    batch_prompt = "".join(prompt_parts)
+
+    batch_max_tokens = sum(estimation_utils.estimate_max_tokens(section_info.get('estimated_minutes', 5)) for section_info in sections)
+    batch_gen_config = _section_generation_config(min(batch_max_tokens, settings.MODEL_ABSOLUTE_MAX_OUTPUT_TOKENS))
+    batch_text, finish_reason = gemini_client.call_gemini_api(batch_model, batch_prompt, batch_gen_config)
+
+    parsed_sections = {}
+    if isinstance(batch_text, str):
+        parsed_sections = {int(number): text.strip() for number, text in _BATCH_SECTION_RE.findall(batch_text)}
+    logging.info("Batched section call returned %s/%s complete sections. Finish Reason: %s", len(parsed_sections), len(sections), finish_reason)
+
+    stream_with_early_stop = settings.USE_DYNAMIC_MAX_TOKENS_FOR_SCRIPT_SECTIONS and settings.STREAM_SECTIONS_WITH_EARLY_STOP
+    section_scripts = []
+    for number, section_info in enumerate(sections, 1):
+        title = section_titles[number - 1]
+        section_text = parsed_sections.get(number)
+        if section_text:
+            # A complete but short section gets the same expansion (and banned-word check) as a single-section draft
+            section_target_minutes = section_info.get('estimated_minutes', 5)
+            section_text = _expand_section_script(
+                batch_model, batch_prompt_prefix, title, section_target_minutes, section_text,
+                estimation_utils.count_words(section_text) + estimation_utils.count_words(title),
+                run_context.is_what_if_scenario, stream_with_early_stop,
+                int(section_target_minutes * settings.WORDS_PER_MINUTE_NARRATION * (1 + settings.SECTION_EARLY_STOP_WORD_BUFFER))
+            )
+            section_scripts.append(_finish_section_script(title, section_text))
+            continue
+        # Missing, empty, or cut off by MAX_TOKENS: generate this section on its own
+        logging.warning("Batched output for section '%s' was missing or incomplete. Falling back to single-section generation.", title)
+        section_scripts.append(generate_single_section_script(
+            gemini_model_script,
+            title,
+            section_info.get('description', ''),
+            section_info.get('estimated_minutes', 5),
+            run_context,
+            gemini_model_script_cheap
+        ))
+    return section_scripts
@@ -1,8 +1,26 @@
 import logging
-from api import gemini_client
+from api import gemini_client, response_store
 from config import settings
 from utils import file_utils
 
+# Global research prompt; {topic} and {minutes} are filled in per run
+_RESEARCH_PROMPT_TEMPLATE = (
+    "Please conduct exceptionally detailed and comprehensive research using available tools based on the following user request. "
+    "The overall goal is to gather enough material for a long-form narrative approximately {minutes} minutes long. "
+    "Focus on gathering extensive key facts, figures, historical context, in-depth narratives covering multiple facets and sub-topics, "
+    "supporting details, and diverse perspectives related to the core request. **Identify the most pivotal or defining factual details, speculative consequences, or unique aspects of the 'what-if' scenario that would be most impactful for a narrative. Also, note any logical branching points or areas of uncertainty within 'what-if' scenarios that could be explored with plausible invention.** "
+    "For each major aspect or event, aim to find several paragraphs of detailed information. "
+    "The output should be a **synthesized summary of the gathered information, written in your own words.** "
+    "While detailed facts, figures, and narrative elements are essential, the goal is a coherent body of research material, "
+    "not a direct concatenation or extensive quotation from source documents. If a very brief, direct quote is absolutely essential "
+    "to convey a specific point that cannot be paraphrased, it must be clearly identified as such, but extensive quoting should be avoided. "
+    "When gathering information, try to draw from diverse and credible sources to ensure a well-rounded understanding of the topic. "
+    "Focus on information that would be particularly suitable for developing into a gentle, sleep-inducing narrative, "
+    "such as descriptive passages, interesting but not jarring anecdotes, context that can be presented calmly, **and specific, illustrative examples of causes and effects or key factual points that can be woven into a calm, story-like account.** "
+    "The output should be a rich, detailed body of text, not a structured outline. "
+    "Ensure depth, breadth, and clarity.\n\nUser Request:\n{topic}"
+)
+
 def perform_global_research(gemini_model_research, user_topic_direction: str, total_target_minutes: int) -> str | None:
     """
     Performs global research using the research model based on user inputs and target length.
@@ -12,25 +30,28 @@ def perform_global_research(gemini_model_research, user_topic_direction: str, to
     print(f"\nPhase 1: Performing Global Research (Web Search Enabled, for ~{total_target_minutes} min total script)...")
 
     # Construct the research prompt
-    research_prompt_detail = (
-        f"Please conduct exceptionally detailed and comprehensive research using available tools based on the following user request. "
-        f"The overall goal is to gather enough material for a long-form narrative approximately {total_target_minutes} minutes long. "
-        f"Focus on gathering extensive key facts, figures, historical context, in-depth narratives covering multiple facets and sub-topics, "
-        f"supporting details, and diverse perspectives related to the core request. **Identify the most pivotal or defining factual details, speculative consequences, or unique aspects of the 'what-if' scenario that would be most impactful for a narrative. Also, note any logical branching points or areas of uncertainty within 'what-if' scenarios that could be explored with plausible invention.** "
-        f"For each major aspect or event, aim to find several paragraphs of detailed information. "
-        f"The output should be a **synthesized summary of the gathered information, written in your own words.** "
-        f"While detailed facts, figures, and narrative elements are essential, the goal is a coherent body of research material, "
-        f"not a direct concatenation or extensive quotation from source documents. If a very brief, direct quote is absolutely essential "
-        f"to convey a specific point that cannot be paraphrased, it must be clearly identified as such, but extensive quoting should be avoided. "
-        f"When gathering information, try to draw from diverse and credible sources to ensure a well-rounded understanding of the topic. "
-        f"Focus on information that would be particularly suitable for developing into a gentle, sleep-inducing narrative, "
-        f"such as descriptive passages, interesting but not jarring anecdotes, context that can be presented calmly, **and specific, illustrative examples of causes and effects or key factual points that can be woven into a calm, story-like account.** "
-        f"The output should be a rich, detailed body of text, not a structured outline. "
-        f"Ensure depth, breadth, and clarity.\n\nUser Request:\n{user_topic_direction}"
-    )
+    research_prompt_detail = _RESEARCH_PROMPT_TEMPLATE.format_map({"topic": user_topic_direction, "minutes": total_target_minutes})
+
+    # Reuse research from an earlier run with the same prompt (topic and length), model setup (system instruction,
+    # search tool) and generation config, skipping the search-enabled call
+    research_generation_config = settings.get_research_generation_config()
+    research_cache_key = None
+    research_text = None
+    if settings.CACHE_RESEARCH_RESULTS:
+        research_cache_key = "research:" + gemini_client._make_cache_key(
+            gemini_client._model_cache_identity(gemini_model_research), research_prompt_detail, research_generation_config
+        )
+        cached = response_store.get_response(research_cache_key, settings.RESEARCH_CACHE_TTL_SECONDS)
+        if cached is not None and isinstance(cached[0], str):
+            research_text = cached[0]
+            logging.info(f"Reusing cached research ({len(research_text)} chars) for this topic and length.")
+            print("Reusing research from a previous run with the same topic and length.")
 
-    # Call the API for research
-    research_text, _ = gemini_client.call_gemini_api(gemini_model_research, research_prompt_detail, settings.RESEARCH_GENERATION_CONFIG)
+    if research_text is None:
+        # Call the API for research
+        research_text, finish_reason = gemini_client.call_gemini_api(gemini_model_research, research_prompt_detail, research_generation_config)
+        if research_text and research_cache_key and finish_reason == "STOP":
+            response_store.store_response(research_cache_key, research_text, finish_reason, 0)
 
     if research_text:
         # Save the research results using the file utility
@@ -1,10 +1,87 @@
+import math
+import hashlib
 import logging
-from api import gemini_client
+import functools
+import dataclasses
+from api import gemini_client, response_store
 from config import settings
-from utils import estimation_utils
+from utils import estimation_utils, text_utils
+
+# Per-chunk smoothing prompt; the static editing instructions live in the smoothing model's system instruction.
+# Only the header varies per run, so it is formatted once and each chunk is appended to it.
+_SMOOTHING_PROMPT_HEADER_TEMPLATE = (
+    "The following text consists of concatenated script sections (or a continuation of previously smoothed text), forming a single long-form narrative on the topic: '{topic}'. "
+    "The target total length for this narrative was approximately {target_minutes} minutes. The current concatenated length is approximately {estimated_minutes:.2f} minutes.\n\n"
+    "Script Text Chunk to Smooth:\n"
+)
+
+@functools.lru_cache(maxsize=64)
+def _smoothing_generation_config(max_output_tokens: int) -> settings.GeminiGenerationConfig:
+    """Returns the shared stitching config for `max_output_tokens`; only the output budget varies between chunks."""
+    return dataclasses.replace(settings.get_stitching_config(), max_output_tokens=max_output_tokens)
+
+def _smoothed_chunk_cache_key(gemini_model_smoother, smoothing_prompt: str) -> str:
+    """Persistent-store key for a smoothed chunk: the model, the smoothing system instruction and the full chunk prompt."""
+    return "smoothing:" + hashlib.blake2b(
+        f"{gemini_model_smoother.model_name}\0{settings.get_smoothing_instruction()}\0{smoothing_prompt}".encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+def _dispatch_smoothing_calls(smoothing_calls: list[tuple]) -> list[tuple[str | None, str]]:
+    """
+    Runs the pending smoothing calls, returning (content, finish_reason) per call in order.
+    A single call (the common case of a script that fits one chunk) is made directly, without the concurrent batch machinery.
+    """
+    if len(smoothing_calls) == 1:
+        return [gemini_client.call_gemini_api(*smoothing_calls[0])]
+    return gemini_client.call_gemini_api_batch(smoothing_calls)
+
+def _smoothing_chunk_limit(script_length: int) -> int:
+    """
+    Picks the smoothing chunk size for a script of `script_length` characters.
+    A chunk must fit both the prompt input limit and what one call can re-emit within the output token cap
+    (the inverse of the per-chunk max_output_tokens sizing). Within that, a script is spread across up to
+    MAX_CONCURRENT_GEMINI_CALLS chunks so idle workers are used, without going below SMOOTHING_MIN_CHUNK_CHARS.
+    """
+    max_chunk_chars = min(settings.SMOOTHING_PROMPT_INPUT_CHAR_LIMIT, int((settings.MODEL_ABSOLUTE_MAX_OUTPUT_TOKENS - 300) * 3.5))
+    chunk_count = max(
+        math.ceil(script_length / max_chunk_chars),
+        min(settings.MAX_CONCURRENT_GEMINI_CALLS, script_length // settings.SMOOTHING_MIN_CHUNK_CHARS),
+        1
+    )
+    return min(max_chunk_chars, math.ceil(script_length / chunk_count))
+
+def _split_at_boundary(text: str, start: int, limit: int) -> int:
+    """
+    Returns where to end the piece of `text` beginning at `start` so it is at most `limit` characters and ends cleanly:
+    at the last paragraph break, else after the last sentence terminator, else (no boundary found) at `start + limit`.
+    """
+    end = start + limit
+    if end >= len(text):
+        return len(text)
+    paragraph_break = text.rfind("\n\n", start, end)
+    if paragraph_break > start:
+        return paragraph_break
+    sentence_end = max(text.rfind(terminator, start, end) for terminator in (". ", "! ", "? "))
+    if sentence_end > start:
+        return sentence_end + 1 # Keep the terminator with its sentence
+    return end
+
+def _split_into_chunks(text: str, limit: int) -> list[str]:
+    """
+    Splits `text` into stripped chunks of at most `limit` characters, cut at paragraph or sentence boundaries.
+    Walks the text by offset, so only the chunks themselves are copied (never the shrinking remainder).
+    """
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = _split_at_boundary(text, start, limit)
+        if chunk := text[start:end].strip():
+            chunks.append(chunk)
+        start = end
+    return chunks
 
 def stitch_and_smooth_script(
-    gemini_model_script,
+    gemini_model_smoother,
     section_scripts_map: dict[str, str],
     section_order: list[str],
     original_user_topic_direction: str,
@@ -12,22 +89,27 @@ def stitch_and_smooth_script(
 ) -> str | None:
     """
     Concatenates generated section scripts and performs an iterative smoothing pass.
+    `gemini_model_smoother` should carry settings.get_smoothing_instruction() as its system instruction;
+    the per-chunk prompts only add the topic, length figures and the chunk itself.
     """
     logging.info("Starting final stitching and smoothing pass...")
     print("\nPhase 4: Stitching sections and performing final smoothing pass...")
 
     # Concatenate scripts in the specified order
-    full_concatenated_script = ""
-    for section_title in section_order:
-        script_content = section_scripts_map.get(section_title, "")
-        if script_content:
-            full_concatenated_script += script_content.strip() + "\n\n"
-
-    full_concatenated_script = full_concatenated_script.strip()
+    section_scripts = [
+        stripped_script for section_title in section_order
+        if (stripped_script := section_scripts_map.get(section_title, "").strip())
+    ]
+    full_concatenated_script = "\n\n".join(section_scripts)
 
     if not full_concatenated_script:
         logging.error("No script content to stitch."); return None
 
+    # With a single section there are no section boundaries to smooth over
+    if len(section_scripts) <= 1:
+        logging.info("Single section, skipping smoothing.")
+        return full_concatenated_script
+
     # Estimate length before smoothing
     estimated_length_before_smoothing = estimation_utils.estimate_script_length_minutes(full_concatenated_script)
     logging.info(f"Estimated length before smoothing: {estimated_length_before_smoothing:.2f} minutes.")
@@ -43,18 +125,42 @@ def stitch_and_smooth_script(
     # but the prompt structure implies smoothing is done on chunks up to SMOOTHING_PROMPT_INPUT_CHAR_LIMIT.
     # Let's adapt the max_output_tokens calculation to the chunk being processed.
 
-    final_script_parts = []
-    current_script_to_process = full_concatenated_script
-    max_smoothing_iterations = 5
-    smoothing_iterations = 0
-
-    # Loop through chunks of the script for smoothing
-    while smoothing_iterations < max_smoothing_iterations and current_script_to_process:
-        smoothing_iterations += 1
-        # Take a chunk up to the defined input limit
-        prompt_text_for_smoothing = current_script_to_process[:settings.SMOOTHING_PROMPT_INPUT_CHAR_LIMIT]
-        logging.info(f"Smoothing pass iteration {smoothing_iterations}. Processing chunk length: {len(prompt_text_for_smoothing)} chars. Remaining: {len(current_script_to_process) - len(prompt_text_for_smoothing)} chars.")
-
+    # Pre-slice the script into chunks that end on paragraph (or sentence) boundaries. Each chunk's prompt depends
+    # only on its own slice, so every chunk can be smoothed concurrently.
+    chunk_limit = _smoothing_chunk_limit(len(full_concatenated_script))
+    chunks_to_smooth = _split_into_chunks(full_concatenated_script, chunk_limit)
+
+    # A short trailing chunk doesn't justify its own round-trip; it is kept as written
+    raw_tail = None
+    if len(chunks_to_smooth) > 1 and len(chunks_to_smooth[-1]) < settings.SMOOTHING_MIN_TAIL_CHARS:
+        raw_tail = chunks_to_smooth.pop()
+        logging.info(f"Keeping the final {len(raw_tail)}-char tail unsmoothed (below {settings.SMOOTHING_MIN_TAIL_CHARS} chars).")
+    logging.info(f"Smoothing {len(full_concatenated_script)} chars in {len(chunks_to_smooth)} chunk(s) of at most {chunk_limit} chars.")
+
+    smoothing_prompt_header = _SMOOTHING_PROMPT_HEADER_TEMPLATE.format_map({
+        "topic": original_user_topic_direction,
+        "target_minutes": total_target_minutes,
+        "estimated_minutes": estimated_length_before_smoothing,
+    })
+    # Chunks smoothed by an earlier attempt with the same script (a retry or resumed run) are reused from the
+    # persistent store, even though smoothing is sampled; only the remaining chunks are sent to the API
+    smoothing_results: list[tuple[str | None, str]] = [(None, "NOT_RUN")] * len(chunks_to_smooth)
+    smoothing_cache_keys: list[str | None] = [None] * len(chunks_to_smooth)
+    smoothing_calls = []
+    pending_chunk_indices = []
+    for chunk_index, prompt_text_for_smoothing in enumerate(chunks_to_smooth):
+        # Swap banned words for gentle stand-ins locally; the smoothing pass then only has to fix phrasing and flow.
+        # Only the prompt is softened: a chunk whose smoothing fails falls back to the text as written.
+        if settings.PRESOFTEN_BANNED_WORDS:
+            prompt_text_for_smoothing = text_utils.soften_banned_words(prompt_text_for_smoothing)
+        smoothing_prompt = smoothing_prompt_header + prompt_text_for_smoothing
+        if settings.CACHE_SMOOTHED_CHUNKS:
+            smoothing_cache_keys[chunk_index] = _smoothed_chunk_cache_key(gemini_model_smoother, smoothing_prompt)
+            cached = response_store.get_response(smoothing_cache_keys[chunk_index], settings.SMOOTHING_CACHE_TTL_SECONDS)
+            if cached is not None and isinstance(cached[0], str):
+                logging.info(f"Reusing cached smoothing for chunk {chunk_index + 1}/{len(chunks_to_smooth)}.")
+                smoothing_results[chunk_index] = (cached[0], cached[1])
+                continue
 
         # Calculate max_output_tokens for this specific chunk dynamically
         # Aim to output roughly the same number of tokens as the input chunk, plus a small buffer
@@ -62,67 +168,37 @@ def stitch_and_smooth_script(
         chunk_input_tokens_approx = int(len(prompt_text_for_smoothing) / 3.5)
         chunk_output_max_tokens = min(chunk_input_tokens_approx + 300, settings.MODEL_ABSOLUTE_MAX_OUTPUT_TOKENS) # Add buffer, cap at model max
 
-        final_script_gen_config = settings.GeminiGenerationConfig(
-            temperature=settings.STITCHING_CONFIG.temperature,
-            max_output_tokens=chunk_output_max_tokens,
-            top_p=settings.STITCHING_CONFIG.top_p,
-            top_k=settings.STITCHING_CONFIG.top_k
-        )
-        logging.info(f"Smoothing pass iteration {smoothing_iterations}: Input chunk approx tokens: {chunk_input_tokens_approx}, Max output tokens for this chunk: {chunk_output_max_tokens}")
-
-
-        # Construct smoothing prompt for the chunk
-        smoothing_prompt = (
-            f"The following text consists of concatenated script sections (or a continuation of previously smoothed text), forming a single long-form narrative on the topic: '{original_user_topic_direction}'. "
-            f"The target total length for this narrative was approximately {total_target_minutes} minutes. The current concatenated length is approximately {estimated_length_before_smoothing:.2f} minutes. "
-            f"Your task is to review this entire provided text. Focus on three main objectives:\n"
-            f"1. Ensure smooth, natural-sounding transitions between where the original section boundaries would have been (if this is the first part of the script) or ensure seamless continuation from previous smoothing work. Make minor edits (e.g., adding a transitional phrase, slightly rephrasing) to improve overall coherence and narrative flow.\n"
-            f"2. Identify and rewrite any phrases, sentences, or short passages that DO NOT align with the established 'Sleep Narrator' persona (defined in the System Instructions as: an exceptionally calm, gentle, soothing, observational chronicler, using soft and evocative language, avoiding jarring or stimulating words, and maintaining a detached, peaceful perspective even on dramatic topics). Replace such phrases with language that IS consistent with this sleep-inducing style. Pay particular attention to ensuring descriptions of potentially dramatic or intense events are filtered through the calm, observational lens, avoiding any language that could evoke strong emotional responses in the listener other than peace and gentle curiosity.\n"
-            f"3. Ensure the overall narrative maintains a consistent 'calm, detached observer' or 'gentle chronicler' perspective throughout. Gently rephrase parts that slip into direct first-person emotional accounts or become too starkly analytical. Ensure even 'what-if' or imaginative content is presented with this same serene, observational, and gently descriptive tone. Ensure a relatively consistent level of descriptive detail and narrative pacing.\n"
-            f"**VERY IMPORTANT: Your primary goal is to improve flow and ensure tonal consistency WHILE STRICTLY MAINTAINING the approximate total word count and length of the provided text. The final output length for THIS CHUNK should be very close to the input chunk's length.** "
-            f"**DO NOT significantly condense or remove content. If you find passages that seem to contradict the persona, your first priority is to REPHRASE them to fit the persona. Only in extreme cases where rephrasing is impossible should minimal content be removed.** "
-            f"Add short transitional sentences if needed for coherence, but the focus is on polishing and preserving length for this chunk. "
-            f"Provide the final, polished, continuous script text for THIS CHUNK, strictly adhering to the System Instruction for the narrator's voice.\n\n"
-            f"Script Text Chunk to Smooth:\n{prompt_text_for_smoothing}"
-        )
-
-        # Call API for smoothing the chunk
-        smoothed_chunk, finish_reason = gemini_client.call_gemini_api(gemini_model_script, smoothing_prompt, final_script_gen_config)
-
-        if smoothed_chunk:
-            final_script_parts.append(smoothed_chunk)
-            logging.info(f"Smoothing pass iteration {smoothing_iterations} successful. Finish reason: {finish_reason}.")
-
-            # Determine if there's more script to process
-            # This simplified logic assumes the chunk processed is exactly the input chunk size
-            # or was cut off at MAX_TOKENS by the model output itself.
-            processed_len = len(prompt_text_for_smoothing) # Assume input chunk was processed
-            if finish_reason == "MAX_TOKENS": # If the *output* was cut off
-                 logging.warning(f"Smoothing pass iteration {smoothing_iterations} hit MAX_TOKENS. The smoothed chunk may be incomplete.")
-                 # This doesn't necessarily mean the *input* chunk wasn't consumed,
-                 # but if the output is shorter than expected, it's safer to move to the next chunk from where the *input* ended.
-                 pass # Continue to update current_script_to_process below
+        final_script_gen_config = _smoothing_generation_config(chunk_output_max_tokens)
+        logging.info(f"Smoothing chunk {chunk_index + 1}/{len(chunks_to_smooth)}: {len(prompt_text_for_smoothing)} chars, input approx tokens: {chunk_input_tokens_approx}, max output tokens: {chunk_output_max_tokens}")
 
-            current_script_to_process = current_script_to_process[processed_len:] # Move past the processed chunk
+        smoothing_calls.append((gemini_model_smoother, smoothing_prompt, final_script_gen_config))
+        pending_chunk_indices.append(chunk_index)
 
-            if not current_script_to_process.strip(): # If remaining is just whitespace
-                current_script_to_process = "" # No more to process
-            # Otherwise, loop continues with the next chunk
+    # Results come back in call order, so each lands in its chunk's slot and the narrative order is kept
+    for chunk_index, (smoothed_chunk, finish_reason) in zip(pending_chunk_indices, _dispatch_smoothing_calls(smoothing_calls)):
+        smoothing_results[chunk_index] = (smoothed_chunk, finish_reason)
+        if smoothed_chunk and finish_reason == "STOP" and smoothing_cache_keys[chunk_index]:
+            response_store.store_response(smoothing_cache_keys[chunk_index], smoothed_chunk, finish_reason, 0)
 
+    final_script_parts = []
+    for chunk_index, (raw_chunk, (smoothed_chunk, finish_reason)) in enumerate(zip(chunks_to_smooth, smoothing_results), start=1):
+        # Parts are stripped one by one (raw chunks already are), so the joined script needs no full-size strip copy
+        smoothed_chunk = (smoothed_chunk or "").strip()
+        if smoothed_chunk:
+            if finish_reason == "MAX_TOKENS": # If the *output* was cut off
+                logging.warning(f"Smoothing chunk {chunk_index} hit MAX_TOKENS. The smoothed chunk may be incomplete.")
+            else:
+                logging.info(f"Smoothing chunk {chunk_index} successful. Finish reason: {finish_reason}.")
+            final_script_parts.append(smoothed_chunk)
         else: # Smoothing failed for this chunk
-            logging.warning(f"Smoothing pass iteration {smoothing_iterations} failed or returned empty. Using raw concatenated script for the remainder.");
-            final_script_parts.append(current_script_to_process) # Add remaining raw script if smoothing fails
-            current_script_to_process = "" # Stop processing
-            break # Exit loop if a chunk fails
-
-    # After the smoothing loop
-    if current_script_to_process and smoothing_iterations >= max_smoothing_iterations:
-         logging.warning("Max smoothing iterations reached, but script remaining to process. Appending raw remaining script.")
-         final_script_parts.append(current_script_to_process)
+            logging.warning(f"Smoothing chunk {chunk_index} failed or returned empty (reason: {finish_reason}). Using the raw chunk.")
+            final_script_parts.append(raw_chunk)
 
+    if raw_tail:
+        final_script_parts.append(raw_tail)
 
     # Combine all smoothed chunks
-    final_script = "\n\n".join(final_script_parts).strip()
+    final_script = "\n\n".join(final_script_parts)
 
     if not final_script: # Should not happen if there was input
         logging.error("Final script is empty after smoothing. Reverting to raw concatenated script.");
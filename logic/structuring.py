@@ -1,59 +1,163 @@
+import asyncio
+import hashlib
 import logging
+import functools
+import dataclasses
 import json
-from api import gemini_client
+from api import gemini_client, response_store
 from config import settings
-from utils import file_utils
+from utils import file_utils, text_utils
 
-def propose_section_structure(gemini_model_structurer, research_content: str, user_topic_direction: str, total_target_minutes: int) -> list[dict] | None:
+# Structuring prompts start with the (truncated) research, identical for the proposal and every retool of a run,
+# so it can be bound once as cached content; the instructions and per-call inputs follow it.
+_RESEARCH_PREFIX_TEMPLATE = "Comprehensive Research Material (use this to inform the section structure):\n{research}\n\n"
+
+_PROPOSAL_PROMPT_TEMPLATE = (
+    "You are an expert content strategist. Based on the provided 'Comprehensive Research Material' above and the 'User's Original Request' below, "
+    "propose a structured outline for a long-form narrative script that will be approximately {minutes} minutes long in total. "
+    "The overall aim is to create a section plan that will form the backbone of a serene, sleep-inducing narrative. Each section should contribute to a gentle unfolding of the topic. "
+    "Suggest between {num_sections_lower} and {num_sections_upper} distinct narrative sections. "
+    "For each proposed section, provide: \n"
+    "1. A concise, engaging 'title'.\n"
+    "2. A single sentence 'description' of its core theme or content.\n"
+    "3. An 'estimated_minutes' for this section (integer).\n"
+    "The sum of your 'estimated_minutes' for all sections should be approximately {minutes} minutes. "
+    "Ensure the sections flow logically, building upon each other where appropriate, and collectively cover the topic comprehensively and engagingly based on the research. "
+    "Output your proposal STRICTLY as a JSON list of objects, where each object has 'title', 'description', and 'estimated_minutes' keys.\n\n"
+    "User's Original Request:\n{topic}"
+)
+
+_RETOOL_PROMPT_TEMPLATE = (
+    "You are an expert content strategist. You previously proposed a section structure. The user has provided feedback. "
+    "Your task is to revise the section structure based *strictly* on the user's feedback. "
+    "Interpret commands like 'keep 1,3', 'remove 2', 'reorder to 3,1,2', 'title of 1 is New Title', 'time of 2 is 10 min', 'break up section X into Y (A min) and Z (B min)'. "
+    "If the user asks to remove themes (e.g., 'no coverage of his time as Vader'), ensure all sections primarily focused on that theme are removed. "
+    "After applying the user's explicit changes, if the sum of 'estimated_minutes' for the new set of sections significantly deviates "
+    "from the overall target of {minutes} minutes, intelligently adjust the times of the sections "
+    "(prioritizing those the user didn't explicitly set time for, or proportionally adjusting others) to get closer to the total target. "
+    "While adhering strictly to explicit user instructions, if the feedback is minimal (e.g., only a time change for one section), ensure the overall narrative logic and comprehensiveness derived from the 'Comprehensive Research Material' are maintained in the revised structure. "
+    "Use the 'Comprehensive Research Material' above to ensure sections are still relevant if titles/descriptions change, or if new sections are implied by 'break up' commands. "
+    "The number of sections should primarily be guided by the user's keep/remove/add/break up instructions.\n\n"
+    "Original Proposal (for context - section numbers are 1-indexed as shown to user; each line is 'number. title | estimated minutes | description'):\n{original_proposal}\n\n"
+    "User's Feedback for Revision:\n{user_feedback}\n\n"
+    "Instructions for Revision:\n"
+    "- Directly apply user's instructions for keeping, removing, reordering, renaming sections, or setting specific section times. If asked to 'break up' a section, create new logical sub-sections with appropriate titles, descriptions, and time allocations that sum to the original section's time or as specified by user, ensuring these new sub-sections are still well-supported by the 'Comprehensive Research Material'.\n"
+    "- After applying direct changes, ensure the NEW sum of 'estimated_minutes' for all sections in your revised proposal is approximately {minutes} minutes. Adjust other section times as needed.\n"
+    "- For each section in your revised proposal, provide: a 'title', a one-sentence 'description', and an 'estimated_minutes' (integer, must be at least 1).\n"
+    "- Output your revised proposal STRICTLY as a JSON list of objects.\n"
+)
+
+@functools.lru_cache(maxsize=4)
+def _build_research_prefix(research_content: str) -> str:
     """
-    Uses the structurer model to propose an initial section structure based on research and user inputs.
-    Saves the proposal to a file.
+    Builds the research block every structuring prompt starts with. The research is the same for the proposal and
+    every retool of a run, so the (truncated) block is built once and reused across the feedback loop.
     """
-    logging.info("AI proposing section structure...")
-    print("\nPhase 2a: AI Proposing Section Structure...")
+    return _RESEARCH_PREFIX_TEMPLATE.format_map({
+        "research": text_utils.truncate_for_prompt(research_content, settings.RESEARCH_CONTEXT_TRUNCATION_CHAR_LIMIT)
+    })
 
-    # Calculate a reasonable range for the number of sections
-    num_sections_lower = max(2, int(total_target_minutes / 15) if total_target_minutes > 15 else 2)
-    num_sections_upper = max(num_sections_lower + 2 , int(total_target_minutes / 7) if total_target_minutes > 7 else 4)
-
-    # Construct the proposal prompt
-    proposal_prompt = (
-        f"You are an expert content strategist. Based on the provided 'Comprehensive Research Material' and the 'User's Original Request', "
-        f"propose a structured outline for a long-form narrative script that will be approximately {total_target_minutes} minutes long in total. "
-        f"The overall aim is to create a section plan that will form the backbone of a serene, sleep-inducing narrative. Each section should contribute to a gentle unfolding of the topic. "
-        f"Suggest between {num_sections_lower} and {num_sections_upper} distinct narrative sections. "
-        f"For each proposed section, provide: \n"
-        f"1. A concise, engaging 'title'.\n"
-        f"2. A single sentence 'description' of its core theme or content.\n"
-        f"3. An 'estimated_minutes' for this section (integer).\n"
-        f"The sum of your 'estimated_minutes' for all sections should be approximately {total_target_minutes} minutes. "
-        f"Ensure the sections flow logically, building upon each other where appropriate, and collectively cover the topic comprehensively and engagingly based on the research. "
-        f"Output your proposal STRICTLY as a JSON list of objects, where each object has 'title', 'description', and 'estimated_minutes' keys.\n\n"
-        f"User's Original Request:\n{user_topic_direction}\n\n"
-        f"Comprehensive Research Material (use this to inform your section proposals):\n{research_content[:settings.RESEARCH_CONTEXT_TRUNCATION_CHAR_LIMIT]}"
-    )
-
-    # Call the API for the proposal
-    raw_response_json, _ = gemini_client.call_gemini_api(gemini_model_structurer, proposal_prompt, settings.SECTION_PROPOSAL_CONFIG)
-
-    sections_list_to_process = None
-    # Attempt to find the list within the JSON response
+# Keys a structurer response may wrap its sections list in, checked in order before any other list value
+_SECTIONS_LIST_KEYS = ("sections", "data", "items")
+
+def _extract_sections_list(raw_response_json) -> list | None:
+    """Finds the list of sections in a structurer JSON response: the response itself, a known key, or any list value."""
     if isinstance(raw_response_json, list):
-        sections_list_to_process = raw_response_json
-    elif isinstance(raw_response_json, dict):
-        if 'sections' in raw_response_json and isinstance(raw_response_json['sections'], list):
-            sections_list_to_process = raw_response_json['sections']
-        elif 'data' in raw_response_json and isinstance(raw_response_json['data'], list):
-            sections_list_to_process = raw_response_json['data']
-        elif 'items' in raw_response_json and isinstance(raw_response_json['items'], list):
-            sections_list_to_process = raw_response_json['items']
-        else:
-            # Check if any value in the dict is a list
-            for key in raw_response_json:
-                if isinstance(raw_response_json[key], list):
-                    sections_list_to_process = raw_response_json[key]
-                    logging.info(f"Found sections list under a non-standard key '{key}' in the JSON response.")
-                    break
+        return raw_response_json
+    if not isinstance(raw_response_json, dict):
+        return None
+    sections_list = next((value for key in _SECTIONS_LIST_KEYS if isinstance(value := raw_response_json.get(key), list)), None)
+    if sections_list is None:
+        key, sections_list = next(((key, value) for key, value in raw_response_json.items() if isinstance(value, list)), (None, None))
+        if key is not None:
+            logging.info(f"Found sections list under a non-standard key '{key}' in the JSON response.")
+    return sections_list
+
+_REQUIRED_SECTION_KEYS = frozenset(("title", "description", "estimated_minutes"))
+
+def _validate_sections(sections_list: list, source: str) -> list[dict]:
+    """
+    Returns the sections that have a title, description and integer estimated_minutes (coerced in place, at least 1).
+    `source` ("proposal" or "retooling") labels the warnings for rejected entries.
+    """
+    valid_sections = []
+    for section in sections_list:
+        if not (isinstance(section, dict) and _REQUIRED_SECTION_KEYS <= section.keys()):
+            logging.warning(f"Invalid section structure in AI {source}: {section}")
+            continue
+        try:
+            section['estimated_minutes'] = max(1, int(section['estimated_minutes'])) # Ensure integer and at least 1
+        except (TypeError, ValueError):
+            logging.warning(f"Invalid 'estimated_minutes' in AI {source} section: {section}")
+            continue
+        valid_sections.append(section)
+    return valid_sections
+
+def _structuring_cache_key(gemini_model_structurer, prompt: str) -> str | None:
+    """
+    Persistent-store key for a structuring prompt (None when caching is off). It covers the structurer system
+    instruction, so editing the persona invalidates stored sections. The prompt's whitespace is collapsed,
+    so re-running a topic that differs only in spacing or line breaks reuses the earlier sections.
+    """
+    if not settings.CACHE_SECTION_STRUCTURES:
+        return None
+    normalized_prompt = " ".join(prompt.split())
+    return "structure:" + hashlib.blake2b(
+        f"{gemini_model_structurer.model_name}\0{settings.get_structurer_instruction()}\0{normalized_prompt}".encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+def _get_cached_sections(cache_key: str | None) -> list[dict] | None:
+    """
+    Returns the sections stored under `cache_key` by an earlier run, or None.
+    Callers re-validate (and, for proposals, re-save) them exactly like a fresh response.
+    """
+    if cache_key is None:
+        return None
+    cached = response_store.get_response(cache_key, settings.STRUCTURE_CACHE_TTL_SECONDS)
+    if cached is not None and isinstance(cached[0], list):
+        logging.info(f"Reusing {len(cached[0])} cached sections for an identical structuring request.")
+        return cached[0]
+    return None
+
+def _remember_sections(cache_key: str | None, valid_sections: list[dict] | None) -> list[dict] | None:
+    """Stores validated sections under `cache_key` for later runs and passes them through."""
+    if valid_sections and cache_key:
+        response_store.store_response(cache_key, valid_sections, "STOP", 0)
+    return valid_sections
+
+def _structuring_config(attempt: int):
+    """Generation config for a proposal/retool attempt: the standard config first, then a cooler one for retries."""
+    if attempt == 0:
+        return settings.get_section_proposal_config()
+    return dataclasses.replace(settings.get_section_proposal_config(), temperature=settings.STRUCTURING_RETRY_TEMPERATURE)
+
+def _log_structuring_retry(attempt: int, source: str):
+    """Logs that an unusable structurer response is being retried, if any attempts remain."""
+    if attempt + 1 < settings.STRUCTURING_MAX_ATTEMPTS:
+        logging.warning(f"AI {source} response was unusable; retrying (attempt {attempt + 2}/{settings.STRUCTURING_MAX_ATTEMPTS}) at temperature {settings.STRUCTURING_RETRY_TEMPERATURE}.")
+        print(f"Retrying the {source} request...")
+
+@functools.lru_cache(maxsize=64)
+def _section_bounds(total_target_minutes: int) -> tuple[int, int]:
+    """Returns the (lower, upper) number of sections to ask for: roughly one per 15 minutes up to one per 7."""
+    num_sections_lower = max(2, total_target_minutes // 15 if total_target_minutes > 15 else 2)
+    num_sections_upper = max(num_sections_lower + 2, total_target_minutes // 7 if total_target_minutes > 7 else 4)
+    return num_sections_lower, num_sections_upper
+
+def _build_proposal_prompt(user_topic_direction: str, total_target_minutes: int) -> str:
+    """Builds the section proposal instructions that follow the research prefix; shared by the sync and async entry points."""
+    num_sections_lower, num_sections_upper = _section_bounds(total_target_minutes)
+
+    return _PROPOSAL_PROMPT_TEMPLATE.format_map({
+        "topic": user_topic_direction,
+        "minutes": total_target_minutes,
+        "num_sections_lower": num_sections_lower,
+        "num_sections_upper": num_sections_upper,
+    })
+
+def _process_proposal_response(raw_response_json) -> list[dict] | None:
+    """Extracts and validates the proposed sections from the structurer's JSON response, saving a valid proposal."""
+    sections_list_to_process = _extract_sections_list(raw_response_json)
 
     if not sections_list_to_process:
         logging.error(f"AI returned a dictionary, but no list of sections found within it. Response: {raw_response_json}")
@@ -61,84 +165,83 @@ def propose_section_structure(gemini_model_structurer, research_content: str, us
         return None
 
     # Validate and clean proposed sections
-    valid_sections = []
-    if isinstance(sections_list_to_process, list): # Ensure it's actually a list before iterating
-        for section in sections_list_to_process:
-            if isinstance(section, dict) and 'title' in section and 'description' in section and 'estimated_minutes' in section:
-                try:
-                    # Ensure minutes is an integer and at least 1
-                    section['estimated_minutes'] = int(section['estimated_minutes'])
-                    if section['estimated_minutes'] < 1: section['estimated_minutes'] = 1
-                    valid_sections.append(section)
-                except ValueError:
-                    logging.warning(f"Invalid 'estimated_minutes' in proposed section: {section}")
-            else:
-                logging.warning(f"Invalid section structure in AI proposal: {section}")
+    valid_sections = _validate_sections(sections_list_to_process, "proposal")
 
     if valid_sections:
         logging.info(f"AI proposed {len(valid_sections)} valid sections.")
-        # Save the initial proposal using the file utility
-        file_utils.save_json_file("section_proposal_initial.json", valid_sections)
+        # Save the initial proposal using the file utility (written in the background; the caller only needs the sections)
+        file_utils.save_json_file_in_background("section_proposal_initial.json", valid_sections)
         return valid_sections
     else:
         logging.error(f"AI proposed sections (extracted list: {sections_list_to_process}) but none were valid after parsing.");
         print("ERROR: AI proposed sections in an invalid format or with missing fields.");
         return None
 
-# Note: The retool_section_structure function is highly similar in structure
-# It will also take the structurer model, user feedback, original proposal, research, and target minutes.
-# It needs to be implemented following the prompt and parsing logic.
+def propose_section_structure(gemini_model_structurer, research_content: str, user_topic_direction: str, total_target_minutes: int) -> list[dict] | None:
+    """
+    Uses the structurer model to propose an initial section structure based on research and user inputs.
+    Saves the proposal to a file.
+    """
+    logging.info("AI proposing section structure...")
+    print("\nPhase 2a: AI Proposing Section Structure...")
+
+    research_prefix = _build_research_prefix(research_content)
+    proposal_prompt = _build_proposal_prompt(user_topic_direction, total_target_minutes)
+
+    cache_key = _structuring_cache_key(gemini_model_structurer, research_prefix + proposal_prompt)
+    cached_sections = _get_cached_sections(cache_key)
+    if cached_sections is not None: # An earlier run already produced sections for this prompt
+        return _remember_sections(cache_key, _process_proposal_response(cached_sections))
+
+    # Call the API for the proposal, retrying with the same prompt if the response is unusable
+    structurer_model, research_prefix_to_send = gemini_client.bind_prefix_cached_model(gemini_model_structurer, research_prefix)
+    valid_sections = None
+    for attempt in range(settings.STRUCTURING_MAX_ATTEMPTS):
+        raw_response_json, _ = gemini_client.call_gemini_api(structurer_model, research_prefix_to_send + proposal_prompt, _structuring_config(attempt))
+        valid_sections = _process_proposal_response(raw_response_json)
+        if valid_sections:
+            break
+        _log_structuring_retry(attempt, "proposal")
+    return _remember_sections(cache_key, valid_sections)
 
-def retool_section_structure(gemini_model_structurer, original_proposal_str: str, user_feedback: str, research_content: str, total_target_minutes: int) -> list[dict] | None:
+async def apropose_section_structure(gemini_model_structurer, research_content: str, user_topic_direction: str, total_target_minutes: int) -> list[dict] | None:
     """
-    Uses the structurer model to revise the section structure based on user feedback.
+    Awaitable variant of propose_section_structure, so several proposals can be gathered concurrently.
     """
-    logging.info(f"AI retooling section structure based on feedback: {user_feedback}")
-    print("\nPhase 2c: AI Retooling Section Structure based on your feedback...")
+    return await asyncio.to_thread(propose_section_structure, gemini_model_structurer, research_content, user_topic_direction, total_target_minutes)
 
-    # Construct the retool prompt
-    retool_prompt = (
-        f"You are an expert content strategist. You previously proposed a section structure. The user has provided feedback. "
-        f"Your task is to revise the section structure based *strictly* on the user's feedback. "
-        f"Interpret commands like 'keep 1,3', 'remove 2', 'reorder to 3,1,2', 'title of 1 is New Title', 'time of 2 is 10 min', 'break up section X into Y (A min) and Z (B min)'. "
-        f"If the user asks to remove themes (e.g., 'no coverage of his time as Vader'), ensure all sections primarily focused on that theme are removed. "
-        f"After applying the user's explicit changes, if the sum of 'estimated_minutes' for the new set of sections significantly deviates "
-        f"from the overall target of {total_target_minutes} minutes, intelligently adjust the times of the sections "
-        f"(prioritizing those the user didn't explicitly set time for, or proportionally adjusting others) to get closer to the total target. "
-        f"While adhering strictly to explicit user instructions, if the feedback is minimal (e.g., only a time change for one section), ensure the overall narrative logic and comprehensiveness derived from the 'Comprehensive Research Material' are maintained in the revised structure. "
-        f"The number of sections should primarily be guided by the user's keep/remove/add/break up instructions.\n\n"
-        f"Original Proposal (for context - section numbers are 1-indexed as shown to user):\n{original_proposal_str}\n\n"
-        f"User's Feedback for Revision:\n{user_feedback}\n\n"
-        f"Comprehensive Research Material (use this to ensure sections are still relevant if titles/descriptions change, or if new sections are implied by 'break up' commands):\n{research_content[:settings.RESEARCH_CONTEXT_TRUNCATION_CHAR_LIMIT]}\n\n" # Truncate [53]
-        f"Instructions for Revision:\n"
-        f"- Directly apply user's instructions for keeping, removing, reordering, renaming sections, or setting specific section times. If asked to 'break up' a section, create new logical sub-sections with appropriate titles, descriptions, and time allocations that sum to the original section's time or as specified by user, ensuring these new sub-sections are still well-supported by the 'Comprehensive Research Material'.\n"
-        f"- After applying direct changes, ensure the NEW sum of 'estimated_minutes' for all sections in your revised proposal is approximately {total_target_minutes} minutes. Adjust other section times as needed.\n"
-        f"- For each section in your revised proposal, provide: a 'title', a one-sentence 'description', and an 'estimated_minutes' (integer, must be at least 1).\n"
-        f"- Output your revised proposal STRICTLY as a JSON list of objects.\n"
-    )
-
-    # Call the API for retooling
-    raw_retooled_response_json, _ = gemini_client.call_gemini_api(gemini_model_structurer, retool_prompt, settings.SECTION_PROPOSAL_CONFIG)
-
-    retooled_sections_list_to_process = None
-    # Attempt to find the list within the JSON response (similar logic to proposal)
-    if isinstance(raw_retooled_response_json, list):
-        retooled_sections_list_to_process = raw_retooled_response_json
-    elif isinstance(raw_retooled_response_json, dict):
-        if 'sections' in raw_retooled_response_json and isinstance(raw_retooled_response_json['sections'], list):
-            retooled_sections_list_to_process = raw_retooled_response_json['sections']
-        elif 'data' in raw_retooled_response_json and isinstance(raw_retooled_response_json['data'], list):
-            retooled_sections_list_to_process = raw_retooled_response_json['data']
-        elif 'items' in raw_retooled_response_json and isinstance(raw_retooled_response_json['items'], list):
-            retooled_sections_list_to_process = raw_retooled_response_json['items']
+def _compact_proposal(original_proposal: str | list[dict]) -> str:
+    """
+    Renders a proposal as one '1. <title> | <minutes>m | <description>' line per section, which carries the same
+    information as indented JSON in roughly half the prompt tokens. Accepts the sections list or its JSON string;
+    a string that doesn't parse to a list is passed through unchanged.
+    """
+    if isinstance(original_proposal, str):
+        try:
+            original_proposal = json.loads(original_proposal)
+        except json.JSONDecodeError:
+            return original_proposal
+        if not isinstance(original_proposal, list):
+            return json.dumps(original_proposal)
+    lines = []
+    for number, section in enumerate(original_proposal, start=1):
+        if isinstance(section, dict):
+            lines.append(f"{number}. {section.get('title', '')} | {section.get('estimated_minutes', '?')}m | {section.get('description', '')}")
         else:
-            # Check if any value is a list
-            for key in raw_retooled_response_json:
-                if isinstance(raw_retooled_response_json[key], list):
-                    retooled_sections_list_to_process = raw_retooled_response_json[key]
-                    logging.info(f"Found retooled sections list under a non-standard key '{key}' in the JSON response.")
-                    break
+            lines.append(f"{number}. {section}")
+    return "\n".join(lines)
 
+def _build_retool_prompt(original_proposal: str | list[dict], user_feedback: str, total_target_minutes: int) -> str:
+    """Builds the section retooling instructions that follow the research prefix; shared by the sync and async entry points."""
+    return _RETOOL_PROMPT_TEMPLATE.format_map({
+        "original_proposal": _compact_proposal(original_proposal),
+        "user_feedback": user_feedback,
+        "minutes": total_target_minutes,
+    })
+
+def _process_retool_response(raw_retooled_response_json) -> list[dict] | None:
+    """Extracts and validates the retooled sections from the structurer's JSON response."""
+    retooled_sections_list_to_process = _extract_sections_list(raw_retooled_response_json)
 
     if not retooled_sections_list_to_process:
         logging.error(f"AI returned a dictionary for retooling, but no list of sections found. Response: {raw_retooled_response_json}")
@@ -146,17 +249,7 @@ def retool_section_structure(gemini_model_structurer, original_proposal_str: str
         return None
 
     # Validate and clean retooled sections
-    valid_sections = []
-    if isinstance(retooled_sections_list_to_process, list): # Ensure it's a list
-        for section in retooled_sections_list_to_process:
-            if isinstance(section, dict) and 'title' in section and 'description' in section and 'estimated_minutes' in section:
-                try:
-                    section['estimated_minutes'] = max(1, int(section['estimated_minutes'])) # Ensure integer and at least 1
-                    valid_sections.append(section)
-                except ValueError:
-                    logging.warning(f"Invalid 'estimated_minutes' in retooled section: {section}")
-            else:
-                logging.warning(f"Invalid section structure in AI retooling: {section}")
+    valid_sections = _validate_sections(retooled_sections_list_to_process, "retooling")
 
     if valid_sections:
         logging.info(f"AI retooled to {len(valid_sections)} valid sections.")
@@ -168,8 +261,35 @@ def retool_section_structure(gemini_model_structurer, original_proposal_str: str
         print("ERROR: AI retooled sections in an invalid format or with missing fields.");
         return None
 
-    # Fallback if response was not a list or dict containing a list
-    # This part is handled by the `if not retooled_sections_list_to_process:` block above
-    # logging.error(f"AI failed to retool sections or returned unexpected format. Raw Response: {raw_retooled_response_json}");
-    # print("ERROR: AI failed to retool or returned an unexpected format.");
-    # return None
\ No newline at end of file
+def retool_section_structure(gemini_model_structurer, original_proposal: str | list[dict], user_feedback: str, research_content: str, total_target_minutes: int) -> list[dict] | None:
+    """
+    Uses the structurer model to revise the section structure based on user feedback.
+    `original_proposal` may be the sections list itself or its JSON string; passing the list skips a re-parse.
+    """
+    logging.info(f"AI retooling section structure based on feedback: {user_feedback}")
+    print("\nPhase 2c: AI Retooling Section Structure based on your feedback...")
+
+    research_prefix = _build_research_prefix(research_content)
+    retool_prompt = _build_retool_prompt(original_proposal, user_feedback, total_target_minutes)
+
+    cache_key = _structuring_cache_key(gemini_model_structurer, research_prefix + retool_prompt)
+    cached_sections = _get_cached_sections(cache_key)
+    if cached_sections is not None: # An earlier run already produced sections for this prompt
+        return _remember_sections(cache_key, _process_retool_response(cached_sections))
+
+    # Call the API for retooling, retrying with the same prompt if the response is unusable
+    structurer_model, research_prefix_to_send = gemini_client.bind_prefix_cached_model(gemini_model_structurer, research_prefix)
+    valid_sections = None
+    for attempt in range(settings.STRUCTURING_MAX_ATTEMPTS):
+        raw_retooled_response_json, _ = gemini_client.call_gemini_api(structurer_model, research_prefix_to_send + retool_prompt, _structuring_config(attempt))
+        valid_sections = _process_retool_response(raw_retooled_response_json)
+        if valid_sections:
+            break
+        _log_structuring_retry(attempt, "retooling")
+    return _remember_sections(cache_key, valid_sections)
+
+async def aretool_section_structure(gemini_model_structurer, original_proposal: str | list[dict], user_feedback: str, research_content: str, total_target_minutes: int) -> list[dict] | None:
+    """
+    Awaitable variant of retool_section_structure, so several revisions can be gathered concurrently.
+    """
+    return await asyncio.to_thread(retool_section_structure, gemini_model_structurer, original_proposal, user_feedback, research_content, total_target_minutes)
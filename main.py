@@ -1,19 +1,16 @@
 import time
-import os
 import json
 import logging
 import re  # For filename sanitization
 import argparse  # For command line argument parsing
-import google.generativeai as genai
-from google.ai.generativelanguage_v1beta.types import GoogleSearchRetrieval
-from google.generativeai.types import Tool
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 # Import modules from your project structure
 from config import settings
-from utils import file_utils, logging_config, estimation_utils
+from utils import console_utils, file_utils, logging_config, estimation_utils
 from ui import cli
-from api import gemini_client
+from api import gemini_client, usage_store
 from logic import research, structuring, generation, stitching
 from tts.tts_manager import TTSManager
 
@@ -78,9 +75,11 @@ def main():
     gemini_model_research = None
     gemini_model_script_narrator = None
     gemini_model_structurer = None
+    gemini_model_smoother = None
+    gemini_model_script_cheap = None # Optional cheaper narrator for short sections (cascade)
 
     try:
-        api_key = os.environ.get("GOOGLE_API_KEY")
+        api_key = settings.ENV.get("GOOGLE_API_KEY")
         if not api_key:
             logging.critical("GOOGLE_API_KEY not set. Please set it in your .env file or environment variables.")
             print("CRITICAL ERROR: GOOGLE_API_KEY not set. Exiting.")
@@ -89,25 +88,38 @@ def main():
             print("replacing YOUR_API_KEY_HERE with your actual key.")
             return
 
-        genai.configure(api_key=api_key)
+        gemini_client.configure(api_key)
 
-        # Initialize models with their respective roles and tools
-        gsr_tool_config = GoogleSearchRetrieval()
-        google_search_tool = Tool(google_search_retrieval=gsr_tool_config)
-        gemini_model_research = genai.GenerativeModel(settings.GEMINI_MODEL_NAME, tools=[google_search_tool])
+        # Initialize models with their respective roles and tools (shared, cached instances)
+        gemini_model_research = gemini_client.get_model(settings.GEMINI_MODEL_NAME, use_search_tool=True)
         logging.info(f"Gemini research model initialized: {settings.GEMINI_MODEL_NAME} with Search.")
         print(f"Gemini research model initialized: {settings.GEMINI_MODEL_NAME} with Search.")
 
-        gemini_model_script_narrator = genai.GenerativeModel(
-            model_name=settings.GEMINI_MODEL_NAME,
-            system_instruction=settings.GEMINI_SYSTEM_INSTRUCTION_NARRATOR
+        gemini_model_script_narrator = gemini_client.get_model(
+            settings.GEMINI_MODEL_NAME,
+            system_instruction=settings.get_narrator_instruction()
         )
         logging.info(f"Gemini script narrator model initialized: {settings.GEMINI_MODEL_NAME}.")
         print(f"Gemini script narrator model initialized: {settings.GEMINI_MODEL_NAME}.")
 
-        gemini_model_structurer = genai.GenerativeModel(
-            model_name=settings.GEMINI_MODEL_NAME,
-            system_instruction=settings.GEMINI_SYSTEM_INSTRUCTION_STRUCTURER
+        if settings.GEMINI_CHEAP_MODEL_NAME:
+            gemini_model_script_cheap = gemini_client.get_model(
+                settings.GEMINI_CHEAP_MODEL_NAME,
+                system_instruction=settings.get_narrator_instruction()
+            )
+            logging.info(f"Gemini cheap script narrator model initialized: {settings.GEMINI_CHEAP_MODEL_NAME}.")
+            print(f"Gemini cheap script narrator model initialized: {settings.GEMINI_CHEAP_MODEL_NAME}.")
+
+        # Smoothing carries its static editing instructions in the system instruction, so each chunk prompt holds only the chunk
+        gemini_model_smoother = gemini_client.get_model(
+            settings.GEMINI_MODEL_NAME,
+            system_instruction=settings.get_smoothing_instruction()
+        )
+        logging.info(f"Gemini smoothing model initialized: {settings.GEMINI_MODEL_NAME}.")
+
+        gemini_model_structurer = gemini_client.get_model(
+            settings.GEMINI_MODEL_NAME,
+            system_instruction=settings.get_structurer_instruction()
         )
         logging.info(f"Gemini structuring model initialized: {settings.GEMINI_MODEL_NAME}.")
         print(f"Gemini structuring model initialized: {settings.GEMINI_MODEL_NAME}.")
@@ -117,7 +129,7 @@ def main():
         print(f"CRITICAL ERROR: Gemini client init failed: {e}. Exiting.")
         return
 
-    if not all([gemini_model_research, gemini_model_script_narrator, gemini_model_structurer]):
+    if not all([gemini_model_research, gemini_model_script_narrator, gemini_model_structurer, gemini_model_smoother]):
         logging.critical("One or more Gemini models failed to init.")
         print("CRITICAL ERROR: Gemini model init failed. Exiting.")
         return
@@ -165,10 +177,9 @@ def main():
 
         # User provided feedback, attempt retooling (allow MAX_ITERATIVE_EXPANSION_ATTEMPTS + 2 retool attempts)
         if i < settings.MAX_ITERATIVE_EXPANSION_ATTEMPTS + 2 : # Check if retool attempts remain
-             original_proposal_str_for_retool = json.dumps(current_proposal_for_retooling, indent=2)
              retooled_list = structuring.retool_section_structure(
                  gemini_model_structurer,
-                 original_proposal_str_for_retool,
+                 current_proposal_for_retooling, # Passed as a list; structuring renders it compactly for the prompt
                  user_feedback_str,
                  global_research_content,
                  total_target_minutes
@@ -195,40 +206,85 @@ def main():
 
     # --- Phase 3: Script Generation for Each Section ---
     generated_section_scripts_map = {} # Dict to store scripts by title
+    # Run-wide prompt inputs (truncated research, what-if detection, shared prefix) are computed once for all sections
+    run_context = generation.build_run_context(user_topic_direction, global_research_content, research_influence)
     final_section_order = [sec['title'] for sec in confirmed_sections]
 
-    for idx, section_info in enumerate(confirmed_sections, 1): # Iterate through confirmed sections with index
-        title = section_info.get('title', 'Untitled Section')
-        description = section_info.get('description', '')
-        section_target_mins = section_info.get('estimated_minutes', 5) # Default to 5 min
-
-        section_script = generation.generate_single_section_script(
+    def generate_section(section_info: dict) -> str | None:
+        return generation.generate_single_section_script(
             gemini_model_script_narrator,
-            title,
-            description,
-            section_target_mins,
-            global_research_content,
-            user_topic_direction,
-            research_influence
+            section_info.get('title', 'Untitled Section'),
+            section_info.get('description', ''),
+            section_info.get('estimated_minutes', 5), # Default to 5 min
+            run_context,
+            gemini_model_script_cheap
         )
 
-        if not section_script: # If section generation fails
-            logging.error(f"Failed to generate script for section: {title}. Halting.")
-            print(f"ERROR: Failed to generate script for section: {title}. Halting.")
-            return # Halt pipeline
-
-        generated_section_scripts_map[title] = section_script # Store generated script
+    def generate_batch(section_batch: list[dict]) -> list[str | None]:
+        return generation.generate_section_batch(
+            gemini_model_script_narrator,
+            section_batch,
+            run_context,
+            gemini_model_script_cheap
+        )
 
-        # Save individual section script with numerical prefix
-        # Sanitize title for filename and add section number prefix
-        section_filename = f"{idx:02d}_script_section_{re.sub(r'[^a-zA-Z0-9_]+', '', title.replace(' ','_'))[:50]}.txt"
-        file_utils.save_text_file(section_filename, section_script)
+    # Sections are independent given the research, so up to MAX_CONCURRENT_SECTIONS are generated concurrently
+    # (the Gemini client enforces rate limits). Each worker's console output is buffered and printed with its result,
+    # in section order, and results are checked in that order so the first failure halts the run.
+    if settings.SECTION_BATCH_SIZE > 1:
+        section_batches = [confirmed_sections[i:i + settings.SECTION_BATCH_SIZE] for i in range(0, len(confirmed_sections), settings.SECTION_BATCH_SIZE)]
+    else:
+        section_batches = [[section_info] for section_info in confirmed_sections]
+
+    def generate_sections(section_batch: list[dict]) -> list[str | None]:
+        if settings.SECTION_BATCH_SIZE > 1:
+            return generate_batch(section_batch)
+        return [generate_section(section_batch[0])]
+
+    # The executor is entered last so it shuts down (joining running workers) while their output is still buffered
+    with console_utils.buffered_worker_output(), ThreadPoolExecutor(max_workers=settings.MAX_CONCURRENT_SECTIONS) as executor:
+        section_futures = [executor.submit(console_utils.run_with_buffered_output, generate_sections, section_batch) for section_batch in section_batches]
+        section_infos = iter(enumerate(confirmed_sections, 1)) # Confirmed sections with index, consumed in order across batches
+
+        def cancel_pending_sections(after_index: int):
+            # Sections not started yet are cancelled; ones already running finish before the executor shuts down
+            for pending_future in section_futures[after_index + 1:]:
+                pending_future.cancel()
+
+        for future_index, section_future in enumerate(section_futures):
+            try:
+                section_scripts, worker_output = section_future.result()
+            except Exception as e: # A worker raised instead of returning None: halt the same way as a failed section
+                print(getattr(e, "worker_output", ""), end="")
+                failed_titles = ", ".join(section_info.get('title', 'Untitled Section') for section_info in section_batches[future_index])
+                logging.error(f"Error while generating script for section: {failed_titles}: {e}. Halting.", exc_info=True)
+                print(f"ERROR: Failed to generate script for section: {failed_titles} ({e}). Halting.")
+                cancel_pending_sections(future_index)
+                return # Halt pipeline
+            print(worker_output, end="")
+
+            for section_script in section_scripts:
+                idx, section_info = next(section_infos)
+                title = section_info.get('title', 'Untitled Section')
+
+                if not section_script: # If section generation fails
+                    logging.error(f"Failed to generate script for section: {title}. Halting.")
+                    print(f"ERROR: Failed to generate script for section: {title}. Halting.")
+                    cancel_pending_sections(future_index)
+                    return # Halt pipeline
+
+                generated_section_scripts_map[title] = section_script # Store generated script
+
+                # Save individual section script with numerical prefix
+                # Sanitize title for filename and add section number prefix
+                section_filename = f"{idx:02d}_script_section_{re.sub(r'[^a-zA-Z0-9_]+', '', title.replace(' ','_'))[:50]}.txt"
+                file_utils.save_text_file(section_filename, section_script)
 
     # --- Phase 4: Stitching and Smoothing ---
     final_script_output_path = file_utils.get_run_specific_path("final_video_script.txt")
 
     final_script_content = stitching.stitch_and_smooth_script(
-        gemini_model_script_narrator,
+        gemini_model_smoother,
         generated_section_scripts_map,
         final_section_order,
         user_topic_direction,
@@ -294,7 +350,7 @@ def main():
             logging.error(f"Could not count tokens for final script: {e}", exc_info=True)
             print(f"Could not count tokens for final script: {e}")
     else: # If no script was generated
-        print(f"Script generation failed. Check logs at: {settings.LOG_FILE_NAME}")
+        print(f"Script generation failed. Check logs at: {file_utils.get_run_specific_path(settings.LOG_FILE_NAME)}")
 
 
     # Report total token usage and paths
@@ -305,6 +361,14 @@ def main():
     print(f"Total accumulated Prompt Tokens: {token_usage['prompt_tokens']}")
     print(f"Total accumulated Candidates Tokens: {token_usage['candidates_tokens']}")
     print(f"Total accumulated Tokens (sum of all calls): {token_usage['total_tokens']}")
+    print(f"Tokens saved by response cache hits: {token_usage['cache_hit_tokens']}")
+    cache_stats = gemini_client.get_cache_stats()
+    print(f"Response cache: {cache_stats['exact_hits']} exact hits, {cache_stats['near_duplicate_hits']} near-duplicate hits, {cache_stats['misses']} misses (hit rate {cache_stats['hit_rate']:.1%}).")
+    if settings.PERSIST_TOKEN_USAGE:
+        all_runs_usage = usage_store.get_persisted_usage()
+        print(f"Total Tokens recorded across all runs: {all_runs_usage['total_tokens']} (database: {settings.TOKEN_USAGE_DB_PATH})")
+    if token_usage['estimated_tokens']:
+        print(f"Of the total, {token_usage['estimated_tokens']} tokens were estimated locally (usage metadata was missing).")
     print(f"Total execution time: {total_execution_time:.2f} seconds.")
 
 
@@ -8,12 +8,16 @@ import time
 import re
 import tempfile
 import wave
+import dataclasses
 from google.cloud import texttospeech
 from google.api_core import retry
 from google.api_core.exceptions import ServiceUnavailable, InternalServerError
 import shutil
 from config.settings import (
+    TTSConfig,
     DEFAULT_TTS_CONFIG,
+    AVAILABLE_VOICES,
+    AUDIO_ENCODING_OPTIONS,
     TTS_MIN_SPEAKING_RATE,
     TTS_MAX_SPEAKING_RATE,
     TTS_CHUNK_SIZE_BYTES,
@@ -26,13 +30,13 @@ from config.settings import (
 class TTSManager:
     """Manages text-to-speech conversion using Google Cloud TTS API."""
     
-    def __init__(self, output_dir: str, config: Dict[str, Any]):
+    def __init__(self, output_dir: str, config: TTSConfig | Dict[str, Any]):
         """
         Initialize the TTS manager.
         
         Args:
             output_dir: Directory where audio files will be saved
-            config: Dictionary containing TTS configuration options
+            config: TTSConfig (or a dictionary of TTSConfig field overrides)
         """
         logging.info(f"Initializing TTS manager with output_dir: {output_dir}")
         self.output_dir = Path(output_dir)
@@ -41,10 +45,23 @@ class TTSManager:
         self.audio_output_dir.mkdir(exist_ok=True)
         
         # TTS configuration - use provided config or fall back to defaults
-        self.voice_name = config.get("voice_name", DEFAULT_TTS_CONFIG["voice_name"])
-        self.language_code = config.get("language_code", DEFAULT_TTS_CONFIG["language_code"])
-        self.speaking_rate = config.get("speaking_rate", DEFAULT_TTS_CONFIG["speaking_rate"])
-        self.audio_encoding = config.get("audio_encoding", DEFAULT_TTS_CONFIG["audio_encoding"])
+        if isinstance(config, dict):
+            config = dataclasses.replace(DEFAULT_TTS_CONFIG, **config)
+        self.voice_name = config.voice_name
+        self.language_code = config.language_code
+        self.speaking_rate = config.speaking_rate
+        self.audio_encoding = config.audio_encoding
+
+        # Validate user-supplied options against the known sets
+        if self.voice_name not in AVAILABLE_VOICES.get(self.language_code, ()):
+            logging.warning(f"Voice '{self.voice_name}' is not in the known voices for {self.language_code}; passing it to the API as-is.")
+        if self.audio_encoding not in AUDIO_ENCODING_OPTIONS:
+            logging.warning(f"Unsupported audio encoding '{self.audio_encoding}'. Falling back to {DEFAULT_TTS_CONFIG.audio_encoding}.")
+            self.audio_encoding = DEFAULT_TTS_CONFIG.audio_encoding
+        if not TTSConfig.MIN_SPEAKING_RATE <= self.speaking_rate <= TTSConfig.MAX_SPEAKING_RATE:
+            clamped_rate = min(max(self.speaking_rate, TTSConfig.MIN_SPEAKING_RATE), TTSConfig.MAX_SPEAKING_RATE)
+            logging.warning(f"Speaking rate {self.speaking_rate} is outside {TTSConfig.MIN_SPEAKING_RATE}-{TTSConfig.MAX_SPEAKING_RATE}. Using {clamped_rate}.")
+            self.speaking_rate = clamped_rate
         
         # Initialize Google Cloud TTS client
         try:
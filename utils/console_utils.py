@@ -0,0 +1,45 @@
+import io
+import sys
+import threading
+import contextlib
+
+# Buffer that print() writes to in the current worker thread, if any (set by run_with_buffered_output)
+_thread_output = threading.local()
+
+class _ThreadRoutedStdout:
+    """Stand-in for sys.stdout: threads with an active buffer write to it, all others write through to the real stream."""
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text: str) -> int:
+        buffer = getattr(_thread_output, "buffer", None)
+        return (buffer if buffer is not None else self._stream).write(text)
+
+    def flush(self):
+        self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+@contextlib.contextmanager
+def buffered_worker_output():
+    """
+    Routes print() output from threads running under run_with_buffered_output into their own buffers,
+    so concurrent workers don't interleave on the terminal; the main thread prints as usual.
+    """
+    with contextlib.redirect_stdout(_ThreadRoutedStdout(sys.stdout)):
+        yield
+
+def run_with_buffered_output(function, *args):
+    """
+    Runs function(*args) with this thread's console output buffered. Returns (result, captured output).
+    If the function raises, the output captured so far is attached to the exception as `worker_output`.
+    """
+    _thread_output.buffer = io.StringIO()
+    try:
+        return function(*args), _thread_output.buffer.getvalue()
+    except Exception as e:
+        e.worker_output = _thread_output.buffer.getvalue()
+        raise
+    finally:
+        _thread_output.buffer = None
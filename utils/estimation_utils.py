@@ -2,12 +2,23 @@ import re
 import logging
 from config import settings
 
+_WORD_RE = re.compile(r'\w+')
+
+def count_words(text: str) -> int:
+    """Counts the words in `text` the same way the length estimate does."""
+    if not text: return 0
+    return len(_WORD_RE.findall(text))
+
 def estimate_script_length_minutes(script_text: str) -> float:
     """Estimates the spoken length of the script text in minutes."""
-    if not script_text or not script_text.strip(): return 0
+    if not script_text or script_text.isspace(): return 0
 
-    word_count = len(re.findall(r'\w+', script_text))
+    word_count = count_words(script_text)
     estimated_minutes = word_count / settings.WORDS_PER_MINUTE_NARRATION
 
     logging.info(f"Estimated script length: {word_count} words, approx. {estimated_minutes:.2f} minutes.")
-    return estimated_minutes
\ No newline at end of file
+    return estimated_minutes
+
+def estimate_max_tokens(minutes: float) -> int:
+    """Returns the max_output_tokens needed to narrate `minutes` of script, capped at the model's absolute limit."""
+    return min(int(minutes * settings.TOKENS_PER_MINUTE_WITH_BUFFER), settings.MODEL_ABSOLUTE_MAX_OUTPUT_TOKENS)
@@ -1,13 +1,22 @@
 import os
 import re
+import atexit
 import logging
+import threading
 from datetime import datetime
+try:
+    import orjson # Optional: faster JSON serialization for saved section lists
+except ImportError:
+    orjson = None
 from config import settings
 
 # Global variable within this module to store the current run directory
 # This is set once by create_run_output_dir when called from main.
 _current_run_output_dir = ""
 
+# Background writes started by save_json_file_in_background, joined at exit so no file is left half-written
+_pending_writes: list[threading.Thread] = []
+
 def create_run_output_dir(topic_title="general_run") -> str:
     """
     Creates a unique directory for the current run's output files
@@ -22,7 +31,7 @@ def create_run_output_dir(topic_title="general_run") -> str:
     sanitized_topic = re.sub(r'\s+', '_', sanitized_topic)
 
     run_folder_name = f"{sanitized_topic[:50]}_{timestamp}"
-    run_dir = os.path.join(settings.BASE_OUTPUT_DIR, run_folder_name)
+    run_dir = str(settings.BASE_OUTPUT_DIR / run_folder_name)
 
     try:
         os.makedirs(run_dir, exist_ok=True)
@@ -39,10 +48,16 @@ def get_run_specific_path(filename: str) -> str:
     if not _current_run_output_dir:
         # Fallback or error if directory wasn't created - though create_run_output_dir exits on failure
         logging.error("current_run_output_dir not set when trying to get path for filename.")
-        return os.path.join(settings.BASE_OUTPUT_DIR, filename)
+        return str(settings.BASE_OUTPUT_DIR / filename)
 
     return os.path.join(_current_run_output_dir, filename)
 
+def _json_dumps_pretty(data) -> bytes:
+    """Serializes data as indented UTF-8 JSON, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2) # orjson.JSONEncodeError subclasses TypeError
+    return json.dumps(data, indent=2).encode("utf-8")
+
 def save_text_file(filename: str, content: str):
     """Saves text content to a file within the current run's output directory."""
     file_path = get_run_specific_path(filename)
@@ -58,8 +73,9 @@ def save_json_file(filename: str, data: dict | list):
     """Saves JSON data to a file within the current run's output directory."""
     file_path = get_run_specific_path(filename)
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+        payload = _json_dumps_pretty(data)
+        with open(file_path, "wb") as f:
+            f.write(payload)
         logging.info(f"Saved JSON file: {file_path}")
     except IOError as e:
         logging.error(f"Failed to save JSON file {file_path}: {e}", exc_info=True)
@@ -68,6 +84,26 @@ def save_json_file(filename: str, data: dict | list):
          logging.error(f"Failed to serialize data to JSON for {file_path}: {e}", exc_info=True)
          print(f"ERROR: Failed to save JSON file {filename} due to data format issue: {e}")
 
+def save_json_file_in_background(filename: str, data: dict | list):
+    """
+    Like save_json_file, but the disk write happens on a background thread so the caller isn't held up.
+    The data is serialized before returning, so later changes to it don't leak into the file.
+    """
+    try:
+        payload = _json_dumps_pretty(data).decode("utf-8")
+    except TypeError as e:
+        logging.error(f"Failed to serialize data to JSON for {filename}: {e}", exc_info=True)
+        print(f"ERROR: Failed to save JSON file {filename} due to data format issue: {e}")
+        return
+    writer = threading.Thread(target=save_text_file, args=(filename, payload), name=f"save-{filename}", daemon=True)
+    writer.start()
+    _pending_writes.append(writer)
+
+@atexit.register
+def _wait_for_pending_writes():
+    """Joins any background writes still in flight."""
+    while _pending_writes:
+        _pending_writes.pop().join()
 
 # Add json import needed for save_json_file
 import json
\ No newline at end of file
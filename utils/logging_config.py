@@ -1,9 +1,9 @@
 import logging
-import os
+from pathlib import Path
 
 def setup_logging(run_output_dir: str, log_file_name: str):
     """Sets up logging to a file within the run-specific output directory."""
-    log_file_path = os.path.join(run_output_dir, log_file_name)
+    log_file_path = Path(run_output_dir) / log_file_name
 
     # Remove any existing handlers to avoid duplicate logs
     for handler in logging.root.handlers[:]:
@@ -14,4 +14,14 @@ def setup_logging(run_output_dir: str, log_file_name: str):
                         format='%(asctime)s - %(levelname)s - %(module)s - %(funcName)s - %(message)s',
                         datefmt='%Y-%m-%d %H:%M:%S')
 
+    # Surface the Gemini client's warnings and errors on the console through logging rather than separate print() calls.
+    # The handler sits on the "api" logger only: elsewhere, errors are already paired with their own print() messages.
+    api_logger = logging.getLogger("api")
+    for handler in api_logger.handlers[:]:
+        api_logger.removeHandler(handler)
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.WARNING)
+    console_handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+    api_logger.addHandler(console_handler)
+
     logging.info(f"Logging initialized. Log file: {log_file_path}")
\ No newline at end of file
@@ -0,0 +1,44 @@
+import re
+from config import settings
+
+# Compiled once; longest words first so overlapping alternatives match greedily
+_BANNED_WORDS_ALTERNATION = "|".join(map(re.escape, sorted(settings.BANNED_NARRATOR_WORDS, key=len, reverse=True)))
+_BANNED_WORDS_RE = re.compile(r"\b(?:" + _BANNED_WORDS_ALTERNATION + r")\b", re.IGNORECASE)
+
+def find_banned_words(text: str) -> list[str]:
+    """Returns every occurrence of a banned narrator word in the text, in order of appearance."""
+    return _BANNED_WORDS_RE.findall(text)
+
+# Same words with an optional preceding "a"/"an", so softening can fix the article for the stand-in
+_SOFTENABLE_WORDS_RE = re.compile(
+    r"\b(?:(?P<article>an?)(?P<space>\s+))?(?P<word>" + _BANNED_WORDS_ALTERNATION + r")\b",
+    re.IGNORECASE
+)
+
+def _soften_match(match: re.Match) -> str:
+    """
+    Returns the replacement for one banned word (and its article). Capitalized words are left alone,
+    since they are usually proper nouns ("the Cuban Missile Crisis", "the Panic of 1873").
+    """
+    word = match.group("word")
+    if word[:1].isupper():
+        return match.group(0)
+    replacement = settings.BANNED_WORD_REPLACEMENTS[word.lower()]
+    article = match.group("article")
+    if article is None:
+        return replacement
+    fixed_article = "an" if replacement[:1] in "aeiou" else "a"
+    if article[:1].isupper():
+        fixed_article = fixed_article.capitalize()
+    return f"{fixed_article}{match.group('space')}{replacement}"
+
+def soften_banned_words(text: str) -> str:
+    """
+    Replaces lowercase banned narrator words with their gentle stand-ins from BANNED_WORD_REPLACEMENTS,
+    correcting a preceding "a"/"an". Meant for text that is about to be smoothed, which repairs any remaining phrasing.
+    """
+    return _SOFTENABLE_WORDS_RE.sub(_soften_match, text)
+
+def truncate_for_prompt(text: str, limit: int = settings.PROMPT_INPUT_CHAR_LIMIT) -> str:
+    """Returns text cut to at most `limit` characters; text that already fits is returned as-is without copying."""
+    return text if len(text) <= limit else text[:limit]